@@ -2,8 +2,8 @@
 Factory de la aplicación Flask
 """
 from flask import Flask
-from flask_cors import CORS
 import logging
+import os
 
 from config import config
 from app.utils.logger import setup_logger
@@ -25,6 +25,10 @@ def create_app(config_name='default'):
     """
     app = Flask(__name__)
     
+    # Serialización JSON con orjson en toda la app (jsonify incluido)
+    from app.utils.json_provider import ORJSONProvider
+    app.json = ORJSONProvider(app)
+    
     # Cargar configuración
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
@@ -33,13 +37,19 @@ def create_app(config_name='default'):
     setup_logger(app)
     logger.info(f"Iniciando aplicación en modo: {config_name}")
     
-    # Configurar CORS
+    # Configurar CORS (import diferido: solo se paga al crear la app)
+    from flask_cors import CORS
     CORS(app, origins=app.config['CORS_ORIGINS'])
     
     # Inicializar conexiones a bases de datos
     db_postgres.init_app(app)
     db_mongo.init_app(app)
     
+    # Snapshot de la config JWT (evita current_app.config en el hot
+    # path de autenticación)
+    from app.middleware.jwt_utils import init_jwt
+    init_jwt(app)
+    
     # Registrar blueprints
     register_blueprints(app)
     
@@ -47,7 +57,10 @@ def create_app(config_name='default'):
     register_error_handlers(app)
     
     # Inicializar Outbox Worker (solo si no estamos en testing)
-    if not app.config.get('TESTING'):
+    # ENABLE_OUTBOX_WORKER=0 permite desactivarlo en procesos que no
+    # sirven tráfico (CLI, gunicorn --preload, tests manuales)
+    worker_enabled = os.getenv('ENABLE_OUTBOX_WORKER', '1') == '1'
+    if worker_enabled and not app.config.get('TESTING'):
         logger.info("→ Intentando inicializar Outbox Worker...")
         try:
             from worker.outbox_worker import init_worker
@@ -71,21 +84,27 @@ def create_app(config_name='default'):
     return app
 
 
+# Tabla de blueprints: (módulo, atributo, url_prefix)
+# Los módulos se importan de forma diferida para no pagar el costo de
+# sus imports transitivos (SQLAlchemy, pymongo, worker) en el arranque
+BLUEPRINTS = (
+    ('app.blueprints.auth', 'auth_bp', '/api/auth'),
+    ('app.blueprints.products', 'products_bp', '/api/products'),
+    ('app.blueprints.inventory', 'inventory_bp', '/api/inventory'),
+    ('app.blueprints.sales', 'sales_bp', '/api/sales'),
+    ('app.blueprints.admin', 'admin_bp', '/api/admin'),
+)
+
+
 def register_blueprints(app):
-    """Registrar todos los blueprints de la aplicación"""
-    
-    from app.blueprints.auth import auth_bp
-    from app.blueprints.products import products_bp
-    from app.blueprints.inventory import inventory_bp
-    from app.blueprints.sales import sales_bp
-    from app.blueprints.admin import admin_bp
-    
-    app.register_blueprint(auth_bp, url_prefix='/api/auth')
-    app.register_blueprint(products_bp, url_prefix='/api/products')
-    app.register_blueprint(inventory_bp, url_prefix='/api/inventory')
-    app.register_blueprint(sales_bp, url_prefix='/api/sales')
-    app.register_blueprint(admin_bp, url_prefix='/api/admin')
-    
+    """Registrar todos los blueprints de la aplicación (import diferido)"""
+
+    import importlib
+
+    for module_name, attr_name, url_prefix in BLUEPRINTS:
+        blueprint = getattr(importlib.import_module(module_name), attr_name)
+        app.register_blueprint(blueprint, url_prefix=url_prefix)
+
     logger.info("✓ Blueprints registrados")
 
 
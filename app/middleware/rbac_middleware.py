@@ -37,10 +37,10 @@ def role_required(*allowed_roles):
                     'your_role': current_user['role']
                 }), 403
             
-            logger.info(
-                f"Acceso autorizado: {current_user['username']} ({current_user['role']}) "
-                f"a recurso que requiere: {allowed_roles}"
-            )
+            # DEBUG con formato lazy: el caso autorizado es el camino
+            # caliente y no aporta en los logs de producción
+            logger.debug("Acceso autorizado: %s (%s) a recurso que requiere: %s",
+                         current_user['username'], current_user['role'], allowed_roles)
             
             return f(current_user, *args, **kwargs)
         
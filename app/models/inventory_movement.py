@@ -1,7 +1,7 @@
 """
 Modelo InventoryMovement - Auditoría de movimientos de inventario
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, CheckConstraint
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, CheckConstraint, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.utils.db_postgres import Base
@@ -28,6 +28,12 @@ class InventoryMovement(Base):
             "movement_type IN ('ENTRY', 'SALE', 'ADJUSTMENT', 'EXPIRATION')",
             name='check_movement_type'
         ),
+        # Índices compuestos para los filtros + ORDER BY created_at DESC
+        # del listado de movimientos (auditoría) y su cursor keyset
+        Index('idx_movements_created_id', created_at.desc(), id.desc()),
+        Index('idx_movements_batch_created', 'product_batch_id', created_at.desc()),
+        Index('idx_movements_user_created', 'user_id', created_at.desc()),
+        Index('idx_movements_type_created', 'movement_type', created_at.desc()),
     )
     
     def to_dict(self, include_relations=False):
@@ -1,7 +1,7 @@
 """
 Modelo OutboxEvent - Patrón Outbox para consistencia eventual
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, CheckConstraint, Index
+from sqlalchemy import Column, Integer, String, Text, DateTime, CheckConstraint, Index, text
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy import JSON
@@ -30,6 +30,12 @@ class OutboxEvent(Base):
             name='check_outbox_status'
         ),
         Index('idx_outbox_status_created', 'status', 'created_at'),
+        # Índice parcial para la cola del worker y oldest_pending
+        # (los eventos PENDING son una fracción pequeña de la tabla)
+        Index(
+            'idx_outbox_pending_created', 'created_at',
+            postgresql_where=text("status = 'PENDING'")
+        ),
     )
     
     def to_dict(self):
@@ -1,7 +1,7 @@
 """
 Modelo Product - Productos del catálogo
 """
-from sqlalchemy import Column, Integer, String, Text, Numeric, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Text, Numeric, Boolean, DateTime, Index, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.utils.db_postgres import Base
@@ -20,8 +20,23 @@ class Product(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
-    # Relaciones
-    batches = relationship('ProductBatch', back_populates='product', lazy='dynamic')
+    # Relaciones. lazy='select' (no 'dynamic') para que los listados
+    # puedan cargar los lotes en bloque con selectinload
+    batches = relationship('ProductBatch', back_populates='product')
+
+    __table_args__ = (
+        # Índice parcial para los conteos/listados de productos activos
+        Index('idx_products_active_true', 'active', postgresql_where=text('active')),
+        # Prefijos de SKU (LIKE 'ABC%'): con colación UTF-8 el B-tree
+        # normal no sirve para LIKE; text_pattern_ops sí
+        Index('idx_products_sku_pat', 'sku', postgresql_ops={'sku': 'text_pattern_ops'}),
+        # Listado típico (activos de una categoría ordenados por
+        # nombre): el índice parcial sirve filtro + ORDER BY sin nodo
+        # Sort. active no va como columna: dentro del índice parcial
+        # es constante
+        Index('idx_products_active_cat_name', 'category', 'name',
+              postgresql_where=text('active')),
+    )
     
     def to_dict(self, include_batches=False):
         """Convertir a diccionario"""
@@ -37,13 +52,13 @@ class Product(Base):
         }
         
         if include_batches:
-            result['batches'] = [batch.to_dict() for batch in self.batches.all()]
+            result['batches'] = [batch.to_dict() for batch in self.batches]
         
         return result
     
     def get_total_stock(self):
         """Obtener stock total de todos los lotes"""
-        return sum(batch.quantity for batch in self.batches.filter_by(quantity__gt=0).all())
+        return sum(batch.quantity for batch in self.batches if batch.quantity > 0)
     
     def __repr__(self):
         return f"<Product {self.sku}: {self.name}>"
\ No newline at end of file
@@ -1,7 +1,7 @@
 """
 Modelo ProductBatch - Lotes de productos con fecha de expiración
 """
-from sqlalchemy import Column, Integer, String, Numeric, Date, DateTime, ForeignKey, CheckConstraint, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Numeric, Date, DateTime, ForeignKey, CheckConstraint, UniqueConstraint, Index, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.utils.db_postgres import Base
@@ -27,6 +27,27 @@ class ProductBatch(Base):
         CheckConstraint('quantity >= 0', name='check_batch_quantity_positive'),
         CheckConstraint('cost_per_unit > 0', name='check_batch_cost_positive'),
         UniqueConstraint('product_id', 'batch_code', name='uq_product_batch'),
+        # Índice parcial para lotes con stock (FIFO, métricas, resumen)
+        Index(
+            'idx_batches_product_instock', 'product_id',
+            postgresql_where=text('quantity > 0')
+        ),
+        # Filtro por producto + orden/rango de vencimiento sobre lotes
+        # con stock (list_batches)
+        Index(
+            'idx_batch_product_exp', 'product_id', 'expiration_date',
+            postgresql_where=text('quantity > 0')
+        ),
+        # Rangos de vencimiento (expired / expiring_soon): parcial sobre
+        # las filas con fecha, más chico que el índice completo
+        Index(
+            'idx_batches_exp_notnull', 'expiration_date',
+            postgresql_where=text('expiration_date IS NOT NULL')
+        ),
+        # Orden del listado sin filtros (expiration ASC NULLS LAST,
+        # received, id): el planner sirve el ORDER BY + LIMIT desde el
+        # índice sin nodo Sort. En Postgres ASC ya implica NULLS LAST.
+        Index('idx_batches_order', 'expiration_date', 'received_date', 'id'),
     )
     
     def to_dict(self, include_product=False):
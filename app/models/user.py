@@ -5,6 +5,13 @@ from sqlalchemy import Column, Integer, String, Boolean, DateTime, CheckConstrai
 from sqlalchemy.sql import func
 from app.utils.db_postgres import Base
 import bcrypt
+import os
+
+# Costo de bcrypt configurable por entorno: 12 en producción,
+# bajarlo (p.ej. 4) en desarrollo/CI donde cada hash de 200ms duele.
+# Público: auth.py lo usa para que el hash de sacrificio del login
+# cueste exactamente lo mismo que uno real
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
 
 
 class User(Base):
@@ -28,7 +35,10 @@ class User(Base):
     
     def set_password(self, password):
         """Hashear y guardar password"""
-        hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        hashed = bcrypt.hashpw(
+            password.encode('utf-8'),
+            bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+        )
         self.hashed_password = hashed.decode('utf-8')
     
     def check_password(self, password):
@@ -27,24 +27,42 @@ class PostgresDB:
         # Detectar si es SQLite (para testing)
         is_sqlite = database_uri.startswith('sqlite')
         
-        # Configuración base del engine
+        # Configuración base del engine. query_cache_size amplía el
+        # cache de statements compilados de SQLAlchemy 2.x (default 500)
         engine_config = {
-            'echo': app.config.get('SQLALCHEMY_ECHO', False)
+            'echo': app.config.get('SQLALCHEMY_ECHO', False),
+            'query_cache_size': 1200,
         }
         
         # Solo agregar opciones de pool si NO es SQLite
         if not is_sqlite:
             engine_config.update({
-                'pool_size': 10,
-                'max_overflow': 20,
-                'pool_pre_ping': True,  # Verificar conexiones antes de usar
+                'pool_size': 20,
+                'max_overflow': 40,
+                # LIFO: reusar el mismo set caliente de conexiones en
+                # vez de rotar por todo el pool (menos conexiones idle
+                # del lado de Postgres y mejor localidad de caches)
+                'pool_use_lifo': True,
+                # Reciclar conexiones cada 5 min en lugar de pagar un
+                # ping extra (pool_pre_ping) en cada checkout
+                'pool_recycle': 300,
+                # Keepalives TCP de libpq: detectan conexiones muertas
+                # (firewall/NAT) sin esperar al timeout del kernel
+                'connect_args': {
+                    'keepalives': 1,
+                    'keepalives_idle': 30,
+                    'keepalives_interval': 10,
+                    'keepalives_count': 3,
+                },
             })
         
         # Crear engine
         self.engine = create_engine(database_uri, **engine_config)
         
-        # Session factory
-        self.session_factory = sessionmaker(bind=self.engine)
+        # Session factory. expire_on_commit=False evita el SELECT de
+        # refresco que dispara cada acceso a atributos tras un commit
+        # (p.ej. new_user.to_dict() justo después de registrarlo)
+        self.session_factory = sessionmaker(bind=self.engine, expire_on_commit=False)
         self.Session = scoped_session(self.session_factory)
         
         logger.info(f"✓ Conectado a base de datos: {database_uri.split('@')[-1] if '@' in database_uri else 'SQLite'}")
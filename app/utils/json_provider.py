@@ -0,0 +1,21 @@
+"""
+Provider JSON basado en orjson para Flask
+"""
+from flask.json.provider import JSONProvider
+import orjson
+
+
+class ORJSONProvider(JSONProvider):
+    """Serializa las respuestas de jsonify con orjson (C).
+
+    orjson maneja datetime/date de forma nativa y default=str cubre
+    Decimal y cualquier otro tipo no estándar, igual que los helpers
+    _json de los blueprints. Sin cambios en los call sites: todo lo
+    que pase por jsonify usa este encoder.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=str).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
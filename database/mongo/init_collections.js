@@ -196,11 +196,28 @@ try {
 
   // Índice para consultas por estado
   db.sales_tickets.createIndex(
-    { "status": 1 }, 
+    { "status": 1 },
     { name: "idx_status" }
   );
   print("✓ Índice en 'status'");
 
+  // Listado de ventas (cajero + estado + orden por fecha): sirve el
+  // filtro y el sort del keyset en un solo índice compuesto
+  db.sales_tickets.createIndex(
+    { "cashier_id": 1, "status": 1, "timestamp": -1 },
+    { name: "idx_cashier_status_timestamp" }
+  );
+  print("✓ Índice compuesto 'cashier_id + status + timestamp'");
+
+  // Rollup diario de ventas (mantenido por el outbox worker):
+  // clave única por (fecha, cajero, método de pago) para los upserts
+  // $inc, y sirve el range scan de /sales/stats
+  db.sales_daily_rollup.createIndex(
+    { "date": 1, "cashier_id": 1, "payment_method": 1 },
+    { unique: true, name: "idx_rollup_date_cashier_method" }
+  );
+  print("✓ Índice único en 'sales_daily_rollup'");
+
 } catch (e) {
   print("⚠ Error al crear índices:");
   print(e.message);
@@ -1,3 +1,6 @@
+-- Extensiones
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Eliminar tablas si existen (para desarrollo)
 DROP TABLE IF EXISTS inventory_movements CASCADE;
 DROP TABLE IF EXISTS outbox_events CASCADE;
@@ -34,8 +37,22 @@ CREATE TABLE products (
 );
 
 CREATE INDEX idx_products_sku ON products(sku);
+-- Prefijos de SKU (search terminado en %): text_pattern_ops permite
+-- range scan para LIKE 'ABC%' bajo colación UTF-8
+CREATE INDEX idx_products_sku_pat ON products(sku text_pattern_ops);
 CREATE INDEX idx_products_name ON products(name);
 CREATE INDEX idx_products_category ON products(category);
+-- Índice parcial para conteos/listados de productos activos
+CREATE INDEX idx_products_active_true ON products(active) WHERE active;
+-- Listado típico (activos por categoría, orden por nombre): sirve
+-- filtro + ORDER BY sin nodo Sort
+CREATE INDEX idx_products_active_cat_name ON products(category, name) WHERE active;
+-- Búsqueda de texto (list_products): GIN trigram sobre la misma
+-- expresión concatenada (y plegada con lower()) que usa el filtro,
+-- para que LIKE '%...%' sea un probe del índice en vez de un seq
+-- scan triple y el recheck compare sin case folding por fila
+CREATE INDEX idx_products_search_trgm ON products
+    USING gin (lower(name || ' ' || sku || ' ' || coalesce(description, '')) gin_trgm_ops);
 
 -- Tabla: product_batches
 CREATE TABLE product_batches (
@@ -52,6 +69,14 @@ CREATE TABLE product_batches (
 
 CREATE INDEX idx_batches_product_id ON product_batches(product_id);
 CREATE INDEX idx_batches_expiration ON product_batches(expiration_date);
+-- Índice parcial para lotes con stock (FIFO, métricas)
+CREATE INDEX idx_batches_product_instock ON product_batches(product_id) WHERE quantity > 0;
+-- Filtro por producto + rango de vencimiento sobre lotes con stock
+CREATE INDEX idx_batch_product_exp ON product_batches(product_id, expiration_date) WHERE quantity > 0;
+-- Rangos de vencimiento (expired / expiring_soon) sobre filas con fecha
+CREATE INDEX idx_batches_exp_notnull ON product_batches(expiration_date) WHERE expiration_date IS NOT NULL;
+-- Orden del listado sin filtros: sirve ORDER BY + LIMIT sin nodo Sort
+CREATE INDEX idx_batches_order ON product_batches(expiration_date, received_date, id);
 
 -- Tabla: inventory_movements
 CREATE TABLE inventory_movements (
@@ -68,6 +93,11 @@ CREATE TABLE inventory_movements (
 CREATE INDEX idx_movements_batch ON inventory_movements(product_batch_id);
 CREATE INDEX idx_movements_user ON inventory_movements(user_id);
 CREATE INDEX idx_movements_created ON inventory_movements(created_at);
+-- Índices compuestos para el listado de auditoría (filtro + created_at DESC)
+CREATE INDEX idx_movements_created_id ON inventory_movements(created_at DESC, id DESC);
+CREATE INDEX idx_movements_batch_created ON inventory_movements(product_batch_id, created_at DESC);
+CREATE INDEX idx_movements_user_created ON inventory_movements(user_id, created_at DESC);
+CREATE INDEX idx_movements_type_created ON inventory_movements(movement_type, created_at DESC);
 
 -- Tabla: outbox_events
 CREATE TABLE outbox_events (
@@ -84,6 +114,8 @@ CREATE TABLE outbox_events (
 
 CREATE INDEX idx_outbox_status_created ON outbox_events(status, created_at);
 CREATE INDEX idx_outbox_aggregate ON outbox_events(aggregate_id);
+-- Índice parcial para la cola del worker (eventos PENDING)
+CREATE INDEX idx_outbox_pending_created ON outbox_events(created_at) WHERE status = 'PENDING';
 
 -- Trigger para actualizar updated_at automáticamente
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -26,4 +26,6 @@ if __name__ == '__main__':
     ╚════════════════════════════════════════════════╝
     """)
     
-    app.run(host=host, port=port, debug=debug)
\ No newline at end of file
+    # threaded explícito: mientras un request espera a Postgres/Mongo
+    # el socket libera el GIL y los demás hilos siguen sirviendo
+    app.run(host=host, port=port, debug=debug, threaded=True)
\ No newline at end of file
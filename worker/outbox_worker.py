@@ -24,6 +24,8 @@ class OutboxWorker:
         self.poll_interval = app.config.get('OUTBOX_POLL_INTERVAL', 5)  # segundos
         self.batch_size = app.config.get('OUTBOX_BATCH_SIZE', 10)
         self.max_retries = app.config.get('OUTBOX_MAX_RETRIES', 3)
+        # Permite despertar al worker sin esperar el próximo poll
+        self.wake_event = threading.Event()
     
     def start(self):
         """Iniciar el worker en un thread separado"""
@@ -42,9 +44,14 @@ class OutboxWorker:
             return
         
         self.running = False
+        self.wake_event.set()  # Salir de la espera inmediatamente
         if self.thread:
             self.thread.join(timeout=10)
         logger.info("✓ Outbox Worker detenido")
+
+    def kick(self):
+        """Despertar al worker para procesar un batch sin esperar el poll"""
+        self.wake_event.set()
     
     def _run(self):
         """Loop principal del worker"""
@@ -57,8 +64,10 @@ class OutboxWorker:
             except Exception as e:
                 logger.error(f"Error en worker loop: {e}", exc_info=True)
             
-            # Esperar antes del siguiente ciclo
-            time.sleep(self.poll_interval)
+            # Esperar antes del siguiente ciclo (o hasta que alguien
+            # despierte al worker con kick())
+            self.wake_event.wait(timeout=self.poll_interval)
+            self.wake_event.clear()
     
     def _process_batch(self):
         """Procesar un lote de eventos pendientes"""
@@ -155,6 +164,24 @@ class OutboxWorker:
             # Insertar en MongoDB
             result = sales_collection.insert_one(ticket_doc)
             
+            # Mantener el rollup diario materializado: un upsert $inc
+            # por venta sobre (fecha, cajero, método de pago).
+            # sales_stats lee esta colección en vez de agregar todos
+            # los tickets
+            rollup_collection = sales_collection.database['sales_daily_rollup']
+            rollup_collection.update_one(
+                {
+                    'date': ticket_doc['timestamp'].strftime('%Y-%m-%d'),
+                    'cashier_id': ticket_doc.get('cashier_id'),
+                    'payment_method': ticket_doc.get('payment_method', 'other')
+                },
+                {'$inc': {
+                    'count': 1,
+                    'amount': float(ticket_doc.get('grand_total', 0))
+                }},
+                upsert=True
+            )
+            
             logger.info(
                 f"  ✓ Ticket creado en MongoDB: {event.aggregate_id} "
                 f"(MongoDB _id: {result.inserted_id})"